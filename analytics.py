@@ -0,0 +1,169 @@
+"""Device usage analytics computed with NumPy over raw DeviceHistory rows.
+
+History in the requested range is read as plain columns (no ORM objects),
+one query per chunk of device ids, and turned into arrays. Duty cycle,
+on/off transition counts and the hour-of-day x weekday heatmap are then
+computed with a handful of vectorized passes over those arrays, so a
+week of history for hundreds of devices never goes through a Python loop
+per row.
+"""
+import time
+from datetime import timezone
+import numpy as np
+from sqlalchemy import func, select
+from models import db, Device, DeviceHistory
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# Device ids per query, well below SQLite's bound parameter limit
+DEVICE_CHUNK_SIZE = 500
+
+# 1970-01-01 was a Thursday (Monday = 0)
+_EPOCH_WEEKDAY = 3
+
+# Seconds since the epoch computed by SQLite, so timestamps never become datetime objects
+_EPOCH_SECONDS = (func.julianday(DeviceHistory.timestamp) - 2440587.5) * 86400.0
+
+def _epoch_seconds(ts):
+    """Naive UTC datetime -> seconds since the epoch"""
+    return ts.replace(tzinfo=timezone.utc).timestamp()
+
+def _chunks(device_ids):
+    for offset in range(0, len(device_ids), DEVICE_CHUNK_SIZE):
+        yield device_ids[offset:offset + DEVICE_CHUNK_SIZE]
+
+def _fetch_tuples(statement):
+    # Core execution and plain tuples: NumPy probes Row objects for array
+    # attributes one by one, which costs more than the query itself
+    return list(map(tuple, db.session.connection().execute(statement).fetchall()))
+
+def load_history(device_ids, start, end):
+    """(n, 4) float array of (device_id, status, value, epoch seconds) for rows in [start, end).
+
+    Rows are ordered by device and time; status is 1/0 and status and value
+    are NaN where the column is null.
+    """
+    arrays = []
+    for chunk in _chunks(device_ids):
+        rows = _fetch_tuples(
+            select(DeviceHistory.device_id, DeviceHistory.status, DeviceHistory.value, _EPOCH_SECONDS)
+            .where(DeviceHistory.device_id.in_(chunk),
+                   DeviceHistory.timestamp >= start,
+                   DeviceHistory.timestamp < end)
+            .order_by(DeviceHistory.device_id, DeviceHistory.timestamp)
+        )
+        if rows:
+            arrays.append(np.array(rows, dtype=np.float64))
+    return np.concatenate(arrays) if arrays else np.empty((0, 4))
+
+def load_status_before(device_ids, start):
+    """(n, 2) float array of (device_id, status) from each device's last history row before start"""
+    # One index seek per device on (device_id, timestamp)
+    last_status = (
+        select(DeviceHistory.status)
+        .where(DeviceHistory.device_id == Device.id, DeviceHistory.timestamp < start)
+        .order_by(DeviceHistory.timestamp.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    arrays = []
+    for chunk in _chunks(device_ids):
+        rows = _fetch_tuples(select(Device.id, last_status).where(Device.id.in_(chunk)))
+        if rows:
+            arrays.append(np.array(rows, dtype=np.float64))
+    return np.concatenate(arrays) if arrays else np.empty((0, 2))
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.full(len(numerator), np.nan), where=denominator > 0)
+
+def _to_list(array, digits=None):
+    """JSON-ready list with NaN as None"""
+    if digits is not None:
+        array = np.round(array, digits)
+    return [None if value != value else value for value in array.tolist()]
+
+def usage_report(device_ids, start, end, utc_offset=0):
+    """Duty cycle, transitions and value heatmap for the given devices between start and end (naive UTC).
+
+    A device's status holds from each history row until its next row or the
+    end of the range; the status of its last row before ``start`` holds from
+    ``start``. Duty cycle is on-time over the time the status is known,
+    which never extends past now. Transitions count changes between
+    consecutive known statuses. The heatmap averages recorded values per
+    weekday and hour, shifted to local time by ``utc_offset`` minutes.
+    """
+    ids = np.unique(np.asarray(device_ids, dtype=np.int64))
+    count = len(ids)
+    start_s, end_s = _epoch_seconds(start), _epoch_seconds(end)
+    history = load_history(ids.tolist(), start, end)
+    before = load_status_before(ids.tolist(), start)
+
+    history_device = np.searchsorted(ids, history[:, 0].astype(np.int64))
+    times, values = history[:, 3], history[:, 2]
+
+    # Status intervals: the carried-over status at start, then one per history row.
+    # The sort is stable, so a carried-over status stays ahead of a row at exactly start
+    device = np.concatenate((np.searchsorted(ids, before[:, 0].astype(np.int64)), history_device))
+    begins = np.concatenate((np.full(len(before), start_s), times))
+    status = np.concatenate((before[:, 1], history[:, 1]))
+    order = np.lexsort((begins, device))
+    device, begins, status = device[order], begins[order], status[order]
+
+    ends = np.empty_like(begins)
+    ends[:-1] = begins[1:]
+    last_of_device = np.ones(len(device), dtype=bool)
+    last_of_device[:-1] = device[1:] != device[:-1]
+    ends[last_of_device] = end_s
+    # Time after now is not known yet
+    durations = np.maximum(np.minimum(ends, time.time()) - begins, 0.0)
+
+    known = ~np.isnan(status)
+    on_seconds = np.bincount(device, weights=np.where(status == 1, durations, 0.0), minlength=count)
+    observed_seconds = np.bincount(device, weights=np.where(known, durations, 0.0), minlength=count)
+
+    known_device, known_status = device[known], status[known]
+    changed = (known_device[1:] == known_device[:-1]) & (known_status[1:] != known_status[:-1])
+    changed_device, changed_to = known_device[1:][changed], known_status[1:][changed]
+    turned_on = np.bincount(changed_device[changed_to == 1], minlength=count)
+    turned_off = np.bincount(changed_device[changed_to == 0], minlength=count)
+    samples = np.bincount(history_device, minlength=count)
+
+    # Heatmap cell = weekday * 24 + hour in local time
+    has_value = ~np.isnan(values)
+    local = times[has_value] + utc_offset * 60
+    days = np.floor_divide(local, 86400)
+    cells = (((days + _EPOCH_WEEKDAY) % 7) * 24 + (local - days * 86400) // 3600).astype(np.intp)
+    value_sums = np.bincount(cells, weights=values[has_value], minlength=7 * 24)
+    value_counts = np.bincount(cells, minlength=7 * 24)
+    averages = _ratio(value_sums, value_counts)
+
+    duty_cycle = _ratio(on_seconds, observed_seconds)
+    total_observed = observed_seconds.sum()
+    return {
+        'totals': {
+            'devices': count,
+            'on_seconds': round(float(on_seconds.sum()), 3),
+            'observed_seconds': round(float(total_observed), 3),
+            'duty_cycle': round(float(on_seconds.sum() / total_observed), 4) if total_observed > 0 else None,
+            'turned_on': int(turned_on.sum()),
+            'turned_off': int(turned_off.sum()),
+            'samples': len(history)
+        },
+        'devices': [{
+            'device_id': device_id,
+            'on_seconds': on,
+            'observed_seconds': observed,
+            'duty_cycle': cycle,
+            'turned_on': ons,
+            'turned_off': offs,
+            'samples': rows
+        } for device_id, on, observed, cycle, ons, offs, rows in zip(
+            ids.tolist(), _to_list(on_seconds, 3), _to_list(observed_seconds, 3), _to_list(duty_cycle, 4),
+            turned_on.tolist(), turned_off.tolist(), samples.tolist())],
+        'heatmap': {
+            'weekdays': list(WEEKDAYS),
+            'hours': list(range(24)),
+            'average': [_to_list(row, 4) for row in averages.reshape(7, 24)],
+            'samples': value_counts.reshape(7, 24).tolist()
+        }
+    }
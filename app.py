@@ -1,21 +1,61 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
 from config import Config
-from models import db, Room, Device  # Import Room and Device directly
+from models import db, Room, Device, ensure_indexes  # Import Room and Device directly
 from routes import api
-from auth_routes import token_required, auth
-from mqtt_client import setup_mqtt_client, disconnect_mqtt
+from auth_routes import auth
+from mqtt_client import setup_mqtt_client
+from history_recorder import setup_history_recorder
+from history_rollups import setup_rollup_backfill
+from device_cache import setup_device_cache
+from storage import init_storage, commit
+from event_hub import setup_event_hub
+from serializers import setup_serializers
+from password_hasher import setup_password_hasher
+from metrics import setup_metrics
+from logging_setup import setup_logging
+from profiling import setup_profiling
+
+def init_database(app):
+    """Create tables and indexes, apply the storage profile and seed an empty database (inside an app context)"""
+    # WAL and connection PRAGMAs before anything touches the database
+    init_storage(app)
+    db.create_all()
+    ensure_indexes()
+    
+    # Add some initial data if database is empty
+    if not db.session.query(db.exists().where(Room.id == 1)).scalar():  # Use imported Room instead of models.Room
+        living_room = Room(name="Living Room")  # Use Room directly
+        bedroom = Room(name="Bedroom")
+        db.session.add_all([living_room, bedroom])
+        commit()
+        
+        devices = [
+            Device(name="Main Light", type="light", room_id=1),  # Use Device directly
+            Device(name="TV", type="plug", room_id=1),
+            Device(name="AC", type="thermostat", value=24, room_id=1),
+            Device(name="Bedroom Light", type="light", room_id=2),
+            Device(name="Fan", type="fan", room_id=2)
+        ]
+        db.session.add_all(devices)
+        commit()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
+    # Leveled logging written by a background thread
+    setup_logging(app)
+    
     # Enable CORS
     CORS(app)
     
     # Initialize extensions
     db.init_app(app)
     
+    # JSON encoder for jsonify(), device listings and MQTT payloads
+    setup_serializers(app)
+    
     # Register blueprints
     app.register_blueprint(api, url_prefix='/api')
     app.register_blueprint(auth, url_prefix='/auth')
@@ -27,33 +67,33 @@ def create_app():
     
     # Create database tables
     with app.app_context():
-        db.create_all()
+        init_database(app)
+        
+        # Load device state into memory and keep it in sync with every commit
+        setup_device_cache(app)
         
-        # Add some initial data if database is empty
-        if not db.session.query(db.exists().where(Room.id == 1)).scalar():  # Use imported Room instead of models.Room
-            living_room = Room(name="Living Room")  # Use Room directly
-            bedroom = Room(name="Bedroom")
-            db.session.add_all([living_room, bedroom])
-            db.session.commit()
-            
-            devices = [
-                Device(name="Main Light", type="light", room_id=1),  # Use Device directly
-                Device(name="TV", type="plug", room_id=1),
-                Device(name="AC", type="thermostat", value=24, room_id=1),
-                Device(name="Bedroom Light", type="light", room_id=2),
-                Device(name="Fan", type="fan", room_id=2)
-            ]
-            db.session.add_all(devices)
-            db.session.commit()
+        # Request, SQL and MQTT metrics at /metrics
+        setup_metrics(app)
+        
+        # Per-request cProfile and SQL trace, only when PROFILING_ENABLED is set
+        setup_profiling(app)
+    
+    # Start the write-behind recorder that fills device_history
+    setup_history_recorder(app)
+    
+    # Aggregate history that was written without rollups, without holding up startup
+    setup_rollup_backfill(app)
+    
+    # Device update fan-out for the streaming endpoint
+    setup_event_hub(app)
+    
+    # Process pool that keeps password hashing off the request threads
+    setup_password_hasher(app)
     
     # Setup MQTT client - uncommented to enable local MQTT
+    # The connection lives for the whole process and is closed at exit
     setup_mqtt_client(app)
     
-    # Register teardown function
-    @app.teardown_appcontext
-    def teardown_mqtt(exception=None):
-        disconnect_mqtt()
-    
     return app
 
 if __name__ == '__main__':
@@ -1,35 +1,174 @@
 # auth_routes.py
-from flask import Blueprint, request, jsonify
-from models import db, User
+from flask import Blueprint, request, jsonify, current_app
+from models import db, User, RefreshToken
+from storage import commit, writer
+from password_hasher import hash_password, verify_password, HasherBusy
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
+from collections import namedtuple, OrderedDict
+from sqlalchemy import event
+import hashlib
 import os
+import secrets
+import threading
+import time
+import uuid
 
 auth = Blueprint('auth', __name__)
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev_secret_key')
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))  # verified tokens kept in memory
+
+# What token_required hands to route handlers instead of a User row
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'username', 'email', 'created_at'])
+
+class TokenCache:
+    """Bounded LRU of verified tokens; each entry expires at its token's exp claim"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token -> (UserSnapshot, exp timestamp)
+        self._user_tokens = {}         # user_id -> set of cached tokens
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token, user, expires_at):
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (user, expires_at)
+            self._user_tokens.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for token in list(self._user_tokens.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, token):
+        user, _ = self._entries.pop(token)
+        tokens = self._user_tokens.get(user.id)
+        if tokens:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[user.id]
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+def invalidate_user_tokens(user_id):
+    """Drop cached verifications for a user, e.g. after the account changed"""
+    token_cache.invalidate_user(user_id)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate_user_tokens(target.id)
 
 # Token required decorator
-def token_required(f):
+def token_required(f=None, allow_query_token=False):
+    """Pass the authenticated user to the view as its first argument.
+
+    The token is read from the Authorization header. Views declared with
+    ``@token_required(allow_query_token=True)`` also accept ``?token=``,
+    for clients such as browser EventSource that cannot set headers.
+    """
+    if f is None:
+        return lambda view: token_required(view, allow_query_token=allow_query_token)
+    
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
         if 'Authorization' in request.headers:
             token = request.headers['Authorization'].split(' ')[1]
+        elif allow_query_token:
+            token = request.args.get('token')
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
-        try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
-        except:
-            return jsonify({'message': 'Token is invalid!'}), 401
+        # Repeat calls with the same token skip the signature check and user lookup
+        current_user = token_cache.get(token)
+        if current_user is None:
+            try:
+                data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+                user = User.query.get(data['user_id'])
+            except:
+                return jsonify({'message': 'Token is invalid!'}), 401
+            
+            if not user:
+                return jsonify({'message': 'Token is invalid!'}), 401
+            
+            current_user = UserSnapshot(user.id, user.username, user.email, user.created_at)
+            if 'exp' in data:
+                token_cache.put(token, current_user, data['exp'])
             
         return f(current_user, *args, **kwargs)
     
     return decorated
 
+def hash_refresh_token(token):
+    """Refresh tokens are random, so a plain SHA-256 is enough to store them safely"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_tokens(user_id, family_id=None):
+    """Create an access token and a new refresh token for a user and commit the refresh token.
+
+    family_id is given when rotating, so the new token stays in its login's family.
+    """
+    now = datetime.utcnow()
+    access_ttl = current_app.config.get('ACCESS_TOKEN_TTL', 900)
+    token = jwt.encode({
+        'user_id': user_id,
+        'exp': now + timedelta(seconds=access_ttl)
+    }, SECRET_KEY, algorithm="HS256")
+    
+    refresh_token = secrets.token_urlsafe(32)
+    db.session.add(RefreshToken(
+        token_hash=hash_refresh_token(refresh_token),
+        user_id=user_id,
+        family_id=family_id or uuid.uuid4().hex,
+        created_at=now,
+        expires_at=now + timedelta(seconds=current_app.config.get('REFRESH_TOKEN_TTL', 2592000))
+    ))
+    commit()
+    
+    return {
+        'token': token,
+        'expires_in': access_ttl,
+        'refresh_token': refresh_token
+    }
+
+def revoke_refresh_tokens(condition):
+    """Revoke the refresh tokens matching condition that are still active; call inside the writer and commit"""
+    return RefreshToken.query.filter(condition, RefreshToken.revoked_at.is_(None)).update(
+        {'revoked_at': datetime.utcnow()}, synchronize_session=False)
+
+def hasher_busy():
+    """Response for a login or register turned away because password hashing is saturated"""
+    response = jsonify({'message': 'Too many logins in progress, try again later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth.route('/register', methods=['POST'])
 def register():
     data = request.json
@@ -40,15 +179,21 @@ def register():
     if existing_user:
         return jsonify({'message': 'Username or email already exists'}), 409
     
+    # Hashing runs in the password hashing pool, off the request thread
+    try:
+        password_hash = hash_password(data['password'])
+    except HasherBusy:
+        return hasher_busy()
+    
     # Create new user
     new_user = User(
         username=data['username'],
-        email=data['email']
+        email=data['email'],
+        password_hash=password_hash
     )
-    new_user.set_password(data['password'])
     
     db.session.add(new_user)
-    db.session.commit()
+    commit()
     
     return jsonify({'message': 'User registered successfully'}), 201
 
@@ -56,27 +201,89 @@ def register():
 def login():
     data = request.json
     
-    # Find user by username or email
-    user = User.query.filter((User.username == data.get('username')) | 
-                             (User.email == data.get('email'))).first()
+    # Find user by username or email, each a lookup on its unique index
+    if data.get('username'):
+        user = User.query.filter_by(username=data['username']).first()
+    elif data.get('email'):
+        user = User.query.filter_by(email=data['email']).first()
+    else:
+        user = None
     
-    if not user or not user.check_password(data['password']):
+    if not user or not data.get('password'):
         return jsonify({'message': 'Invalid credentials'}), 401
     
-    # Generate token
-    token = jwt.encode({
-        'user_id': user.id,
-        'exp': datetime.utcnow() + timedelta(hours=24)
-    }, SECRET_KEY, algorithm="HS256")
+    try:
+        valid = verify_password(user.password_hash, data['password'])
+    except HasherBusy:
+        return hasher_busy()
+    if not valid:
+        return jsonify({'message': 'Invalid credentials'}), 401
     
-    return jsonify({
-        'token': token,
-        'user': {
-            'id': user.id,
-            'username': user.username,
-            'email': user.email
-        }
-    })
+    with writer:
+        # Drop this user's refresh tokens that can no longer be used
+        RefreshToken.query.filter(RefreshToken.user_id == user.id,
+                                  RefreshToken.expires_at < datetime.utcnow()).delete()
+        response = issue_tokens(user.id)
+    response['user'] = {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email
+    }
+    return jsonify(response)
+
+@auth.route('/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new access token and a new refresh token"""
+    data = request.json or {}
+    token = data.get('refresh_token')
+    if not token:
+        return jsonify({'message': 'Refresh token is missing!'}), 401
+    
+    # An indexed lookup of the token's hash; no password check involved
+    now = datetime.utcnow()
+    stored = RefreshToken.query.filter_by(token_hash=hash_refresh_token(token)).first()
+    if not stored or stored.expires_at <= now:
+        return jsonify({'message': 'Refresh token is invalid!'}), 401
+    
+    with writer:
+        # Conditional update, so two requests racing with the same token can't both rotate it
+        rotated = RefreshToken.query.filter_by(id=stored.id, revoked_at=None).update({'revoked_at': now})
+        if not rotated:
+            # Already rotated or revoked: the token was replayed, so nothing from this login is trusted
+            revoke_refresh_tokens(RefreshToken.family_id == stored.family_id)
+            db.session.commit()
+            return jsonify({'message': 'Refresh token is invalid!'}), 401
+        
+        if not db.session.get(User, stored.user_id):
+            db.session.commit()
+            return jsonify({'message': 'Refresh token is invalid!'}), 401
+        
+        response = issue_tokens(stored.user_id, stored.family_id)
+    return jsonify(response)
+
+@auth.route('/logout', methods=['POST'])
+def logout():
+    """Revoke the refresh token (and its rotations) issued by one login"""
+    data = request.json or {}
+    token = data.get('refresh_token')
+    if not token:
+        return jsonify({'message': 'Refresh token is missing!'}), 400
+    
+    stored = RefreshToken.query.filter_by(token_hash=hash_refresh_token(token)).first()
+    if stored:
+        with writer:
+            revoke_refresh_tokens(RefreshToken.family_id == stored.family_id)
+            db.session.commit()
+    return jsonify({'message': 'Logged out'})
+
+@auth.route('/revoke', methods=['POST'])
+@token_required
+def revoke(current_user):
+    """Revoke every refresh token of the current user, signing out all of their clients"""
+    with writer:
+        revoked = revoke_refresh_tokens(RefreshToken.user_id == current_user.id)
+        db.session.commit()
+    return jsonify({'message': 'All sessions revoked', 'revoked': revoked})
 
 @auth.route('/user', methods=['GET'])
 @token_required
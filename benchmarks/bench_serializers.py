@@ -0,0 +1,76 @@
+"""Micro-benchmark: encoding a large device list.
+
+Compares the old per-request path (build a dict per device, then jsonify's
+json.dumps with sorted keys) with serializers.encode_devices() on the cached
+snapshots the device listings use, for each installed JSON encoder. With the
+stdlib encoder, "cold" has no cached fragments and encodes the whole list in
+one call (warming a few fragments on the way), and "cached" joins the bytes
+of unchanged devices; orjson encodes the whole list in one call either way.
+
+    python benchmarks/bench_serializers.py [--devices 10000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serializers
+from repository import DEVICE_FIELDS
+
+DEVICE_TYPES = ('light', 'fan', 'thermostat', 'temperature', 'humidity', 'motion', 'door', 'window')
+
+def make_rows(count):
+    rng = random.Random(42)
+    return [(device_id, f"Device {device_id}", rng.choice(DEVICE_TYPES), rng.random() < 0.5,
+             round(rng.uniform(0, 100), 1), 1 + device_id // 20) for device_id in range(1, count + 1)]
+
+def legacy_encode(rows):
+    # What the routes did before: a hand-built dict per device, then jsonify()
+    devices = [{
+        'id': row[0],
+        'name': row[1],
+        'type': row[2],
+        'status': row[3],
+        'value': row[4],
+        'room_id': row[5]
+    } for row in rows]
+    return json.dumps(devices, sort_keys=True).encode()
+
+def best_ms(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.devices)
+    baseline = best_ms(lambda: legacy_encode(rows), args.repeat)
+    print(f"{args.devices} devices, best of {args.repeat}")
+    print(f"{'case':<36}{'ms':>10}{'speedup':>10}")
+    print(f"{'dict per device + json.dumps':<36}{baseline:>10.2f}{1:>9.1f}x")
+
+    for name in serializers.ENCODERS:
+        serializers.set_encoder(name)
+
+        def cold():
+            serializers._encoded_devices.clear()
+            return serializers.encode_devices([dict(zip(DEVICE_FIELDS, row)) for row in rows])
+
+        snapshots = [dict(zip(DEVICE_FIELDS, row)) for row in rows]
+        for snapshot in snapshots:
+            serializers.encode_device(snapshot)
+        assert json.loads(serializers.encode_devices(snapshots)) == json.loads(legacy_encode(rows))
+
+        for label, func in ((f"{name}: encode_devices, cold", cold),
+                            (f"{name}: encode_devices, cached", lambda: serializers.encode_devices(snapshots))):
+            elapsed = best_ms(func, args.repeat)
+            print(f"{label:<36}{elapsed:>10.2f}{baseline / elapsed:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Benchmark suite for the server hot paths.
+
+Covers MQTT on_message parsing/decoding, publish_device_status against an
+in-process fake MQTT connection, token_required, and every read endpoint of
+routes.py through the Flask test client against seeded databases of 1k, 10k
+and 100k devices. Each database size runs in its own process on a fresh
+SQLite file, so runs are reproducible and don't touch smart_home.db.
+
+    python benchmarks/run_benchmarks.py [--sizes 1000,10000,100000] [--output results.json]
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+
+Results are written as JSON (one entry per case, per-call times in
+microseconds) together with the git commit they were measured on, so runs
+from different commits can be compared with --compare.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEVICES_PER_ROOM = 20
+HISTORY_ROWS = 20000
+DEVICE_TYPES = ('light', 'fan', 'thermostat', 'plug', 'sensor', 'temperature', 'humidity', 'motion')
+ROUNDS = 5
+
+# Benchmark processes must never reach a real broker, and measure production (non-debug)
+# responses even when .env enables FLASK_DEBUG; set before anything loads .env
+os.environ['MQTT_BROKER_URL'] = '127.0.0.1'
+os.environ['MQTT_BROKER_PORT'] = '1'
+os.environ['MQTT_RECONNECT_MAX_DELAY'] = '3600'
+os.environ['FLASK_DEBUG'] = '0'
+
+class FakeResult:
+    rc = 0
+
+class FakeConnection:
+    """Stands in for MqttConnectionManager: accepts every publish in-process"""
+    client_id = 'benchmark'
+    state = 'connected'
+    last_error = None
+    reconnects = 0
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published += 1
+        return FakeResult()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def measure(func):
+    """Per-call seconds (min, median) over ROUNDS rounds of an auto-sized number of calls"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [elapsed / number for elapsed in timer.repeat(repeat=ROUNDS, number=number)]
+    return min(times), statistics.median(times), number
+
+def seed_database(path, devices):
+    """Schema through the app's own init_database(), then bulk rows with executemany"""
+    from flask import Flask
+    from werkzeug.security import generate_password_hash
+    from config import Config
+    from models import db
+    from app import init_database
+
+    Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    with app.app_context():
+        init_database(app)
+        db.engine.dispose()
+
+    rng = random.Random(devices)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO user (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                 ('bench', 'bench@example.com', generate_password_hash('bench'), datetime.utcnow()))
+    user_id = conn.execute("SELECT id FROM user WHERE username = 'bench'").fetchone()[0]
+
+    room_count = max(1, devices // DEVICES_PER_ROOM)
+    first_room = conn.execute("SELECT COALESCE(MAX(id), 0) FROM room").fetchone()[0] + 1
+    conn.executemany("INSERT INTO room (id, name, owner_id) VALUES (?, ?, ?)",
+                     [(first_room + i, f"Room {i}", user_id) for i in range(room_count)])
+    conn.executemany("INSERT INTO device (name, type, status, value, room_id) VALUES (?, ?, ?, ?, ?)",
+                     [(f"Device {i}", rng.choice(DEVICE_TYPES), rng.random() < 0.5, round(rng.uniform(0, 100), 1),
+                       first_room + i % room_count) for i in range(devices)])
+    device_id = conn.execute("SELECT MIN(id) FROM device WHERE room_id >= ?", (first_room,)).fetchone()[0]
+
+    # A week of history for one device, rolled up by the app on startup
+    start = datetime.utcnow() - timedelta(days=7)
+    step = timedelta(days=7) / HISTORY_ROWS
+    conn.executemany("INSERT INTO device_history (device_id, status, value, timestamp) VALUES (?, ?, ?, ?)",
+                     [(device_id, i % 2, float(i % 50), start + step * i) for i in range(HISTORY_ROWS)])
+    conn.commit()
+    conn.close()
+    return user_id, device_id, first_room
+
+def run_size(devices, core):
+    """Run every case against one database size; returns result dicts"""
+    workdir = tempfile.mkdtemp(prefix='smart-home-bench-')
+    os.environ['MQTT_SUBSCRIBER_LOCK'] = os.path.join(workdir, 'subscriber.lock')
+    path = os.path.join(workdir, 'bench.db')
+
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        user_id, device_id, room_id = seed_database(path, devices)
+
+        import jwt
+        import mqtt_client
+        import auth_routes
+        from app import create_app
+        from models import Device
+        from mqtt_ingest import IngestWorker
+        from mqtt_publisher import OutboundPublisher
+
+        app = create_app()
+
+        # Swap the real (unreachable) connection and workers for in-process stand-ins
+        mqtt_client.connection.close()
+        mqtt_client.connection = FakeConnection()
+        mqtt_client.ingest_worker.stop()
+        mqtt_client.ingest_worker = IngestWorker(app, max_queue=0)
+        # Unbounded and not drained: measures what a request thread pays to publish
+        mqtt_client.publisher.stop()
+        mqtt_client.publisher = OutboundPublisher(mqtt_client._send_message, mqtt_client._is_connected, max_queue=0)
+        mqtt_client.MQTT_SUPPRESS_UNCHANGED = False
+
+    token = jwt.encode({'user_id': user_id, 'exp': time.time() + 86400}, auth_routes.SECRET_KEY, algorithm='HS256')
+    headers = {'Authorization': f'Bearer {token}'}
+    client = app.test_client()
+    results = []
+
+    def record(group, name, func):
+        with contextlib.redirect_stdout(quiet):
+            best, median, number = measure(func)
+        quiet.seek(0)
+        quiet.truncate()
+        results.append({
+            'group': group,
+            'name': name,
+            'devices': devices,
+            'per_call_us_min': round(best * 1e6, 3),
+            'per_call_us_median': round(median * 1e6, 3),
+            'ops_per_sec': round(1 / best, 1),
+            'calls_per_round': number,
+            'rounds': ROUNDS
+        })
+        print(f"  {group:<8} {name:<40} {best * 1e6:>12.1f} us")
+
+    print(f"{devices} devices")
+
+    if core:
+        messages = {
+            'on_message json control': FakeMessage(f'smart-home/devices/{device_id}/control', b'{"status": true, "value": 42}'),
+            'on_message plain-text command': FakeMessage(f'smart-home/light/{device_id}/control', b'on'),
+            'on_message numeric command': FakeMessage(f'smart-home/control/{device_id}', b'21.5'),
+            'on_message own echo (dropped)': FakeMessage(
+                f'smart-home/light/{device_id}/status',
+                json.dumps({'id': device_id, 'status': True, 'origin': mqtt_client.MQTT_ORIGIN_ID}).encode()),
+            'on_message all/updates sync': FakeMessage(
+                'smart-home/all/updates',
+                json.dumps({'id': device_id, 'name': 'Device', 'type': 'light', 'status': True, 'value': 1.0,
+                            'room_id': room_id, 'origin': mqtt_client.MQTT_ORIGIN_ID, 'instance': 'other'}).encode())
+        }
+        for name, message in messages.items():
+            record('mqtt', name, lambda message=message: mqtt_client.on_message(None, None, message))
+            mqtt_client.ingest_worker._queue.queue.clear()
+
+        with app.app_context():
+            device = Device.query.get(device_id)
+            record('mqtt', 'publish_device_status (enqueue)', lambda: mqtt_client.publish_device_status(device))
+            mqtt_client.publisher._queue.queue.clear()
+
+            def publish_and_send():
+                for topic, payload, qos, retain in mqtt_client._device_messages(device):
+                    mqtt_client._send_message(topic, payload, qos, retain)
+            record('mqtt', 'publish_device_status (encode + send)', publish_and_send)
+
+        @auth_routes.token_required
+        def view(current_user):
+            return current_user.id
+
+        with app.test_request_context(headers=headers):
+            record('auth', 'token_required (cached)', view)
+
+            def uncached():
+                auth_routes.token_cache.clear()
+                return view()
+            record('auth', 'token_required (decode + user lookup)', uncached)
+
+    etag = client.get('/api/devices', headers=headers).headers.get('ETag')
+    history_to = datetime.utcnow().isoformat()
+    history_from = (datetime.utcnow() - timedelta(days=7)).isoformat()
+    endpoints = {
+        'GET /api/rooms': ('/api/rooms', {}),
+        'GET /api/devices': ('/api/devices', {}),
+        'GET /api/devices (If-None-Match, 304)': ('/api/devices', {'If-None-Match': etag}),
+        'GET /api/devices?limit=100': ('/api/devices?limit=100', {}),
+        'GET /api/devices?fields=id,status': ('/api/devices?fields=id,status', {}),
+        'GET /api/rooms/<id>/devices': (f'/api/rooms/{room_id}/devices', {}),
+        'GET /api/sensor_data': ('/api/sensor_data', {}),
+        'GET /api/advanced_sensor_data': ('/api/advanced_sensor_data', {}),
+        'GET /api/device_status': ('/api/device_status', {}),
+        'GET /api/devices/<id>/history': (f'/api/devices/{device_id}/history?from={history_from}&to={history_to}', {}),
+        'GET /api/mqtt_status': ('/api/mqtt_status', {})
+    }
+    for name, (url, extra_headers) in endpoints.items():
+        request_headers = dict(headers, **extra_headers)
+        status = client.get(url, headers=request_headers).status_code
+        if status not in (200, 304):
+            raise RuntimeError(f"{url} returned {status}")
+        record('http', name, lambda url=url, request_headers=request_headers: client.get(url, headers=request_headers))
+
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {(r['group'], r['name'], r['devices']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    print(f"{'case':<58}{'devices':>9}{'old us':>12}{'new us':>12}{'change':>9}")
+    for result in new:
+        key = (result['group'], result['name'], result['devices'])
+        if key not in old:
+            continue
+        before, after = old[key]['per_call_us_min'], result['per_call_us_min']
+        print(f"{result['group'] + ' ' + result['name']:<58}{result['devices']:>9}{before:>12.1f}{after:>12.1f}"
+              f"{(after - before) / before * 100:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the server hot paths")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated device counts to seed")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two results files")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--core', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--results-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.worker:
+        # Child process: one database size
+        results = run_size(args.worker, args.core)
+        with open(args.results_file, 'w') as f:
+            json.dump(results, f)
+        return
+
+    import serializers
+    results = []
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results_file = os.path.join(tempfile.mkdtemp(prefix='smart-home-bench-'), 'results.json')
+    for index, size in enumerate(sizes):
+        # The size-independent cases only run with the first database
+        command = [sys.executable, os.path.abspath(__file__), '--worker', str(size), '--results-file', results_file]
+        if index == 0:
+            command.append('--core')
+        subprocess.run(command, check=True)
+        with open(results_file) as f:
+            results.extend(json.load(f))
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'json_encoder': serializers.set_encoder(os.getenv('JSON_ENCODER', 'auto')),
+        'sizes': sizes,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+if __name__ == '__main__':
+    main()
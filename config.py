@@ -4,4 +4,70 @@ class Config:
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'smart_home.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SECRET_KEY = 'your-secret-key'
\ No newline at end of file
+    SECRET_KEY = 'your-secret-key'
+
+    # Device history write-behind buffer
+    HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', 500))  # rows per INSERT transaction
+    HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 1.0))  # max seconds a row waits in memory
+    HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', 10000))  # buffered rows before producers are throttled
+    HISTORY_ENQUEUE_TIMEOUT = float(os.getenv('HISTORY_ENQUEUE_TIMEOUT', 0.05))  # seconds to wait on a full buffer before dropping
+    ROLLUP_BACKFILL_CHUNK = int(os.getenv('ROLLUP_BACKFILL_CHUNK', 10))  # devices per transaction when building missing rollups
+
+    # In-process device state cache serving the read endpoints
+    DEVICE_CACHE_ENABLED = os.getenv('DEVICE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    DEVICE_CACHE_MAX_DEVICES = int(os.getenv('DEVICE_CACHE_MAX_DEVICES', 100000))  # devices kept before LRU owners are evicted
+    DEVICE_CACHE_TTL = float(os.getenv('DEVICE_CACHE_TTL', 30))  # seconds before a cached owner is checked against the database, 0 for never
+    DEVICE_PAGE_MAX_LIMIT = int(os.getenv('DEVICE_PAGE_MAX_LIMIT', 1000))  # largest ?limit= accepted by device listings
+    DEVICE_STATUS_COUNTERS = os.getenv('DEVICE_STATUS_COUNTERS', 'true').lower() in ('1', 'true', 'yes')  # per-owner counts for /api/device_status
+
+    # SQLite storage profile, applied to every new connection
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')  # readers don't block the writer
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')  # durable with WAL, fewer fsyncs than FULL
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))  # wait for other processes' locks
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 268435456))  # bytes of the file memory-mapped (256 MB)
+    SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -65536))  # page cache; negative values are KiB (64 MB)
+
+    # Server-Sent Events stream of device updates
+    STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 100))  # events buffered per client before it is evicted
+    STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 1000))  # concurrent streams per process
+    STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', 15))  # seconds between keepalive comments
+
+    # JSON encoding: 'auto' uses orjson when installed, 'json' forces the standard library
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
+
+    # Bulk device control
+    BATCH_MAX_COMMANDS = int(os.getenv('BATCH_MAX_COMMANDS', 500))  # commands accepted per POST /api/devices/batch
+
+    # Tokens issued by /auth/login and /auth/refresh
+    ACCESS_TOKEN_TTL = int(os.getenv('ACCESS_TOKEN_TTL', 900))  # seconds an access token (JWT) is valid
+    REFRESH_TOKEN_TTL = int(os.getenv('REFRESH_TOKEN_TTL', 2592000))  # seconds a refresh token is valid (30 days)
+
+    # Password hashing pool used by login and register
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # hashing processes per server process; 0 hashes on the request thread
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 4))  # logins hashing or waiting at once; keep below WEB_THREADS
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 1.0))  # seconds to wait for a free worker before 503
+
+    # Prometheus metrics at GET /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+    # Logging (logging_setup.py)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG adds a line per MQTT message
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json' (one object per line)
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))  # fraction of per-message debug lines written
+    LOG_WARNINGS_PER_SECOND = int(os.getenv('LOG_WARNINGS_PER_SECOND', 10))  # per-message warnings written per second
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # records buffered before new ones are dropped
+
+    # Per-request profiling (profiling.py); nothing is installed unless enabled
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    PROFILING_KEY = os.getenv('PROFILING_KEY', '')  # required: X-Profile must carry this key
+    PROFILING_N_PLUS_ONE = int(os.getenv('PROFILING_N_PLUS_ONE', 5))  # repeats of one statement reported as N+1
+    PROFILING_STATS_LIMIT = int(os.getenv('PROFILING_STATS_LIMIT', 30))  # functions listed in the cProfile summary
+
+    # Usage analytics (analytics.py)
+    ANALYTICS_MAX_RANGE_DAYS = int(os.getenv('ANALYTICS_MAX_RANGE_DAYS', 92))  # longest from/to span one request may analyse
+
+    # Production server (serve.py)
+    WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:5000')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', os.cpu_count() or 1))  # worker processes
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 8))  # request threads per worker; each open /api/stream holds one
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 60))  # seconds before a silent worker is restarted
\ No newline at end of file
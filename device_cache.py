@@ -0,0 +1,366 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from models import db, Room, Device
+from repository import DEVICE_FIELDS, owner_device_rows, owner_room_rows, owner_ids
+from serializers import device_dict
+
+log = logging.getLogger(__name__)
+
+class DeviceStateCache:
+    """In-process cache of device state, indexed per room owner.
+
+    Owners are loaded as a whole (all their rooms and devices, one query each)
+    the first time they are read and kept in LRU order; once more than
+    ``max_devices`` devices are cached the least recently used owners are
+    evicted. Committed ORM changes to Device and Room rows are written
+    through automatically by the session hooks installed in
+    setup_device_cache(), so reads of a cached owner never hit the database.
+
+    Every cached owner carries a version that changes whenever any of its
+    rooms or devices does. Versions come from one process-wide counter, so an
+    owner that is evicted and reloaded never reuses an old version; together
+    with ``epoch`` they identify a state of the owner's devices.
+
+    Changes committed by other server processes only arrive as MQTT sync
+    messages, which can be lost. With a ``ttl`` an owner read more than ttl
+    seconds after it was loaded is read from the database again; if nothing
+    changed it keeps its version, so ETags stay valid.
+    """
+
+    def __init__(self, max_devices=100000, enabled=True, counters=True, ttl=30):
+        self.max_devices = max_devices
+        self.enabled = enabled
+        self.ttl = ttl  # seconds before a cached owner is revalidated; 0 keeps owners until evicted
+        self.counters = counters  # keep per-owner {type: [total, online]} counts up to date
+        self._lock = threading.RLock()
+        self._devices = {}                 # device_id -> snapshot
+        self._rooms = {}                   # room_id -> {'id', 'name', 'owner_id'} for cached owners
+        self._owners = OrderedDict()       # owner_id -> {'rooms', 'devices', 'counts'}, LRU order
+        self._loads_in_flight = 0
+        self._writes_during_load = {}      # device_id -> snapshot (or None for deletes) seen while loading
+        self._expired = {}                 # owner_id -> (version, rooms, devices by id) awaiting revalidation
+        self._versions = itertools.count(1)
+        self.epoch = format(int(time.time() * 1000), 'x')  # distinguishes versions of this process from others
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    # Reads
+
+    def get_owner_devices(self, owner_id):
+        """Device snapshots in all rooms owned by owner_id, ordered by id"""
+        with self._lock:
+            owner = self._touch(owner_id)
+            if owner is not None:
+                return self._owner_devices(owner)
+        rooms, devices = self._load_owner(owner_id)
+        return devices
+
+    def get_owner_devices_versioned(self, owner_id):
+        """(version, device snapshots) read together; version is None if the owner can't be cached"""
+        with self._lock:
+            owner = self._touch(owner_id)
+            if owner is not None:
+                return owner['version'], self._owner_devices(owner)
+        rooms, devices = self._load_owner(owner_id)
+        with self._lock:
+            owner = self._owners.get(owner_id)
+            if owner is not None:
+                return owner['version'], self._owner_devices(owner)
+        return None, devices
+
+    def owner_version(self, owner_id):
+        """Current version of a cached owner, or None if the owner isn't cached"""
+        with self._lock:
+            owner = self._touch(owner_id)
+            if owner is not None:
+                return owner['version']
+            if owner_id not in self._expired:
+                return None
+        # Revalidate now, so an unchanged owner can still be answered with 304
+        self._load_owner(owner_id)
+        with self._lock:
+            owner = self._owners.get(owner_id)
+            return owner['version'] if owner is not None else None
+
+    def get_owner_rooms(self, owner_id):
+        """Room dicts owned by owner_id, ordered by id"""
+        with self._lock:
+            owner = self._touch(owner_id)
+            if owner is not None:
+                return [self._rooms[room_id] for room_id in owner['rooms']]
+        rooms, devices = self._load_owner(owner_id)
+        return rooms
+
+    def get_room_devices(self, owner_id, room_id):
+        """Device snapshots in one of owner_id's rooms (empty for rooms they don't own)"""
+        return [device for device in self.get_owner_devices(owner_id) if device['room_id'] == room_id]
+
+    def get_owner_type_counts(self, owner_id):
+        """{type: {'total', 'online'}} for a cached owner, or None if the owner isn't cached"""
+        with self._lock:
+            owner = self._owners.get(owner_id)
+            if owner is None or owner['counts'] is None or self._is_expired(owner):
+                return None
+            return {device_type: {"total": total, "online": online}
+                    for device_type, (total, online) in owner['counts'].items() if total}
+
+    def owner_of_room(self, room_id):
+        """Owner id of a cached room, or None if the room's owner isn't cached"""
+        room = self._rooms.get(room_id)
+        return room['owner_id'] if room else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "owners": len(self._owners),
+                "devices": len(self._devices),
+                "max_devices": self.max_devices,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "revalidations": self.revalidations
+            }
+
+    # Write-through and invalidation hooks
+
+    def upsert_device(self, snapshot):
+        with self._lock:
+            if self._loads_in_flight:
+                self._writes_during_load[snapshot['id']] = snapshot
+            room = self._rooms.get(snapshot['room_id'])
+            old = self._devices.get(snapshot['id'])
+            if old:
+                old_room = self._rooms.get(old['room_id'])
+                if room and old_room and room['owner_id'] == old_room['owner_id']:
+                    # Same owner: replace in place so the owner's devices stay ordered by id
+                    owner = self._owners[room['owner_id']]
+                    self._count(owner, old, -1)
+                    self._devices[snapshot['id']] = snapshot
+                    self._count(owner, snapshot, 1)
+                    owner['version'] = next(self._versions)
+                    return
+                del self._devices[snapshot['id']]
+                self._unlink_device(old)
+            if room is None:
+                # The owner isn't cached; it will be read fresh on first use
+                return
+            self._link_device(self._owners[room['owner_id']], snapshot)
+
+    def remove_device(self, device_id):
+        with self._lock:
+            if self._loads_in_flight:
+                self._writes_during_load[device_id] = None
+            old = self._devices.pop(device_id, None)
+            if old:
+                self._unlink_device(old)
+
+    def invalidate_owner(self, owner_id):
+        with self._lock:
+            owner = self._owners.pop(owner_id, None)
+            if owner is None:
+                return
+            for room_id in owner['rooms']:
+                self._rooms.pop(room_id, None)
+            for device_id in owner['devices']:
+                self._devices.pop(device_id, None)
+
+    def invalidate_room(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room:
+                self.invalidate_owner(room['owner_id'])
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._rooms.clear()
+            self._owners.clear()
+            self._expired.clear()
+
+    def warm(self):
+        """Load every owner up front when the whole table fits in the cache"""
+        if not self.enabled:
+            return 0
+        if db.session.query(Device.id).count() > self.max_devices:
+            return 0
+        owners = owner_ids()
+        for owner_id in owners:
+            self._load_owner(owner_id)
+        return len(owners)
+
+    # Internals
+
+    def _is_expired(self, owner):
+        return bool(self.ttl) and time.monotonic() - owner['loaded_at'] > self.ttl
+
+    def _touch(self, owner_id):
+        owner = self._owners.get(owner_id)
+        if owner is not None and self._is_expired(owner):
+            # Kept until the reload, which compares against it
+            self._expired[owner_id] = (
+                owner['version'],
+                [self._rooms[room_id] for room_id in owner['rooms']],
+                {device_id: self._devices[device_id] for device_id in owner['devices']}
+            )
+            self.invalidate_owner(owner_id)
+            self.revalidations += 1
+            owner = None
+        if owner is None:
+            self.misses += 1
+            return None
+        self._owners.move_to_end(owner_id)
+        self.hits += 1
+        return owner
+
+    def _owner_devices(self, owner):
+        if not owner['ordered']:
+            # A device moved in from another owner's room landed at the end
+            for device_id in sorted(owner['devices']):
+                owner['devices'].move_to_end(device_id)
+            owner['ordered'] = True
+        return [self._devices[device_id] for device_id in owner['devices']]
+
+    def _link_device(self, owner, snapshot):
+        devices = owner['devices']
+        if devices and snapshot['id'] < next(reversed(devices)):
+            owner['ordered'] = False
+        self._devices[snapshot['id']] = snapshot
+        devices[snapshot['id']] = None
+        self._count(owner, snapshot, 1)
+        owner['version'] = next(self._versions)
+
+    def _unlink_device(self, snapshot):
+        room = self._rooms.get(snapshot['room_id'])
+        if room:
+            owner = self._owners[room['owner_id']]
+            if snapshot['id'] in owner['devices']:
+                del owner['devices'][snapshot['id']]
+                self._count(owner, snapshot, -1)
+                owner['version'] = next(self._versions)
+
+    def _count(self, owner, snapshot, delta):
+        if owner['counts'] is None:
+            return
+        counts = owner['counts'].setdefault(snapshot['type'] or "unknown", [0, 0])
+        counts[0] += delta
+        if snapshot['status']:
+            counts[1] += delta
+
+    def _load_owner(self, owner_id):
+        with self._lock:
+            self._loads_in_flight += 1
+        try:
+            rooms = [{'id': room_id, 'name': name, 'owner_id': owner_id}
+                     for room_id, name in owner_room_rows(owner_id)]
+            devices = [dict(zip(DEVICE_FIELDS, row)) for row in owner_device_rows(owner_id)]
+        finally:
+            with self._lock:
+                self._loads_in_flight -= 1
+                writes = self._writes_during_load
+                if not self._loads_in_flight:
+                    self._writes_during_load = {}
+
+        if not self.enabled or len(devices) > self.max_devices:
+            with self._lock:
+                self._expired.pop(owner_id, None)
+            return rooms, devices
+
+        with self._lock:
+            if owner_id in self._owners:
+                # Another thread loaded it first and has been kept current since
+                owner = self._touch(owner_id)
+                return ([self._rooms[room_id] for room_id in owner['rooms']],
+                        self._owner_devices(owner))
+            previous = self._expired.pop(owner_id, None)
+            previous_devices = previous[2] if previous else {}
+            room_ids = {room['id'] for room in rooms}
+            owner = {'rooms': OrderedDict(), 'devices': OrderedDict(), 'counts': {} if self.counters else None,
+                     'ordered': True, 'version': None, 'loaded_at': time.monotonic()}
+            for room in rooms:
+                self._rooms[room['id']] = room
+                owner['rooms'][room['id']] = None
+            for device in devices:
+                # Changes committed while the query ran win over what it read
+                device = writes.get(device['id'], device)
+                if device is None or device['room_id'] not in room_ids:
+                    continue
+                if previous_devices.get(device['id']) == device:
+                    # Unchanged: keep the old snapshot and with it its cached JSON
+                    device = previous_devices[device['id']]
+                self._link_device(owner, device)
+            owner['version'] = next(self._versions)
+            if previous and previous[1] == rooms and len(previous_devices) == len(owner['devices']) and all(
+                    self._devices[device_id] is previous_devices.get(device_id) for device_id in owner['devices']):
+                # Revalidated without changes: clients holding the old ETag still get 304
+                owner['version'] = previous[0]
+            self._owners[owner_id] = owner
+            self._evict(keep=owner_id)
+            devices = self._owner_devices(owner)
+        return rooms, devices
+
+    def _evict(self, keep):
+        while len(self._devices) > self.max_devices and len(self._owners) > 1:
+            owner_id = next(iter(self._owners))
+            if owner_id == keep:
+                self._owners.move_to_end(owner_id)
+                continue
+            self.invalidate_owner(owner_id)
+            self.evictions += 1
+
+device_cache = DeviceStateCache()
+
+def _collect_changes(session, flush_context):
+    """Snapshot Device/Room changes at flush time; applied only if the transaction commits"""
+    pending = session.info.setdefault('device_cache_pending', [])
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Device):
+            pending.append(('device', device_dict(obj)))
+        elif isinstance(obj, Room):
+            pending.append(('room', (obj.id, obj.owner_id)))
+    for obj in session.deleted:
+        if isinstance(obj, Device):
+            pending.append(('device_deleted', obj.id))
+        elif isinstance(obj, Room):
+            pending.append(('room', (obj.id, obj.owner_id)))
+
+def _apply_changes(session):
+    pending = session.info.pop('device_cache_pending', None)
+    if not pending:
+        return
+    for kind, change in pending:
+        if kind == 'device':
+            device_cache.upsert_device(change)
+        elif kind == 'device_deleted':
+            device_cache.remove_device(change)
+        else:
+            # Room ownership or naming changed: reload both affected owners lazily
+            room_id, owner_id = change
+            device_cache.invalidate_room(room_id)
+            device_cache.invalidate_owner(owner_id)
+
+def _discard_changes(session, *args):
+    session.info.pop('device_cache_pending', None)
+
+def setup_device_cache(app):
+    """Configure the cache, install the write-through hooks and warm it (inside an app context)"""
+    device_cache.enabled = app.config.get('DEVICE_CACHE_ENABLED', True)
+    device_cache.max_devices = app.config.get('DEVICE_CACHE_MAX_DEVICES', 100000)
+    device_cache.counters = app.config.get('DEVICE_STATUS_COUNTERS', True)
+    device_cache.ttl = app.config.get('DEVICE_CACHE_TTL', 30)
+    device_cache.clear()
+
+    if not event.contains(db.session, 'after_flush', _collect_changes):
+        event.listen(db.session, 'after_flush', _collect_changes)
+        event.listen(db.session, 'after_commit', _apply_changes)
+        event.listen(db.session, 'after_rollback', _discard_changes)
+
+    owners = device_cache.warm()
+    log.info("Device cache loaded %s owners (%s devices)", owners, device_cache.stats()['devices'])
+    return device_cache
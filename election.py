@@ -0,0 +1,74 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+class FileLockElection:
+    """Elects one process on this host by holding an exclusive lock on a file.
+
+    The first process to lock ``path`` is the leader until it exits; the
+    operating system drops the lock even if the process is killed. The others
+    become standbys that retry every ``interval`` seconds on a background
+    thread and call ``on_elected()`` once they take over.
+    """
+
+    def __init__(self, path, interval=5, on_elected=None):
+        self.path = path
+        self.interval = interval
+        self.on_elected = on_elected
+        self.leader = False
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Try to become leader now; if another process is, keep trying in the background"""
+        if self.try_acquire():
+            return True
+        if not self._thread or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._standby, name="leader-election", daemon=True)
+            self._thread.start()
+        return False
+
+    def try_acquire(self):
+        if self.leader:
+            return True
+        lock_file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # Record the leader's pid for whoever is debugging which worker subscribes
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        self.leader = True
+        return True
+
+    def stop(self):
+        """Stop the standby thread and give up leadership"""
+        self._stop.set()
+        if self._file:
+            self._file.close()  # closing the file releases the lock
+            self._file = None
+        self.leader = False
+
+    def _standby(self):
+        while not self._stop.wait(self.interval):
+            if self.try_acquire():
+                if self.on_elected:
+                    self.on_elected()
+                return
@@ -0,0 +1,133 @@
+import itertools
+import queue
+import threading
+from models import db, Room
+from device_cache import device_cache
+
+# Marker delivered to a subscription that was dropped for falling behind
+EVICTED = object()
+
+class Subscription:
+    """One streaming client: a bounded buffer of encoded events for a single owner"""
+
+    def __init__(self, owner_id, max_buffer):
+        self.owner_id = owner_id
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self.evicted = False
+
+    def get(self, timeout=None):
+        """Next (event_id, data) tuple, EVICTED, or None if nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _offer(self, event):
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def _evict(self):
+        self.evicted = True
+        # Make room for the marker so the client's generator notices promptly
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self._queue.put_nowait(EVICTED)
+        except queue.Full:
+            pass  # a concurrent publish refilled it; the client sees evicted on its next wait
+
+class EventHub:
+    """Fans device update events out to the streaming clients of each owner.
+
+    Publishing never blocks: every subscription has a bounded buffer and a
+    client whose buffer is full is evicted (it reconnects and starts over)
+    instead of slowing down the publisher or growing memory.
+    """
+
+    def __init__(self, max_buffer=100, max_clients=1000):
+        self.max_buffer = max_buffer
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # owner_id -> set of Subscription
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, owner_id):
+        """Register a client; returns None when max_clients are already connected"""
+        with self._lock:
+            if self.client_count() >= self.max_clients:
+                return None
+            subscription = Subscription(owner_id, self.max_buffer)
+            self._subscriptions.setdefault(owner_id, set()).add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.owner_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.owner_id]
+
+    def client_count(self):
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, owner_id, data):
+        """Deliver an encoded event to every client of owner_id"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(owner_id, ()))
+        if not subscriptions:
+            return 0
+        event = (next(self._ids), data)
+        delivered = 0
+        for subscription in subscriptions:
+            if subscription._offer(event):
+                delivered += 1
+            else:
+                subscription._evict()
+                self.unsubscribe(subscription)
+                self.evictions += 1
+        self.published += 1
+        return delivered
+
+    def owner_of_room(self, room_id):
+        """Owner id of a room from the device cache, else the database (needs an app context)"""
+        owner_id = device_cache.owner_of_room(room_id)
+        if owner_id is None:
+            owner_id = db.session.query(Room.owner_id).filter(Room.id == room_id).scalar()
+        return owner_id
+
+    def publish_device_update(self, room_id, data, owner_id=None):
+        """Route a device update to the owner of its room; the owner is looked up when not given"""
+        if not self._subscriptions:
+            return 0
+        if owner_id is None:
+            owner_id = self.owner_of_room(room_id)
+        if owner_id is None:
+            return 0
+        return self.publish(owner_id, data)
+
+    def stats(self):
+        return {
+            "clients": self.client_count(),
+            "published": self.published,
+            "evictions": self.evictions
+        }
+
+event_hub = EventHub()
+
+def setup_event_hub(app):
+    """Apply the streaming limits from the app config"""
+    event_hub.max_buffer = app.config.get('STREAM_BUFFER_SIZE', 100)
+    event_hub.max_clients = app.config.get('STREAM_MAX_CLIENTS', 1000)
+    return event_hub
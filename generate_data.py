@@ -1,7 +1,28 @@
-import sqlite3
+"""Generate a synthetic smart home database for development and load testing.
+
+    python generate_data.py                       # 3 users, a few rooms and devices each, 7 days of history
+    python generate_data.py --db load.db --force --users 100 --rooms-per-user 50 --devices-per-room 20 \\
+        --history-days 7 --history-interval 30 --workers 4
+
+Counts accept a fixed number or a MIN-MAX range. The same --seed always
+produces the same users, rooms, devices and history (history timestamps are
+anchored to the current hour). History is written with batched executemany
+calls in large transactions, together with the minute and hour rollups the
+server would have built from it; with --workers N it is generated by N
+processes into temporary shard databases that are then copied in with one
+INSERT ... SELECT per table.
+"""
+import argparse
+import itertools
+import multiprocessing
 import os
 import random
+import sqlite3
+import sys
+import tempfile
+import time
 from datetime import datetime, timedelta
+from operator import itemgetter
 from werkzeug.security import generate_password_hash
 
 # Database path
@@ -30,22 +51,79 @@ DEVICE_TYPES = {
     "sensor": ["Motion Sensor", "Temperature Sensor", "Humidity Sensor", "Door Sensor"]
 }
 
-# Sample users
+# Sample users; generated users beyond these are user4, user5, ... sharing --password
 USERS = [
     {"username": "admin", "email": "admin@example.com", "password": "adminpass"},
     {"username": "john", "email": "john@example.com", "password": "johnpass"},
     {"username": "alice", "email": "alice@example.com", "password": "alicepass"},
 ]
 
+# Chance that a device switches on or off between two history samples
+STATUS_CHANGE_PROBABILITY = 0.2
+
+# Device history table, also used for the shards written by worker processes
+HISTORY_TABLE = '''
+    CREATE TABLE IF NOT EXISTS device_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER NOT NULL,
+        status BOOLEAN,
+        value FLOAT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (device_id) REFERENCES device (id)
+    )
+'''
+
+# Minute and hour rollups of device_history (see models.py)
+ROLLUP_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        device_id INTEGER NOT NULL,
+        bucket DATETIME NOT NULL,
+        count INTEGER NOT NULL,
+        value_count INTEGER NOT NULL,
+        value_sum FLOAT NOT NULL,
+        value_min FLOAT,
+        value_max FLOAT,
+        last_value FLOAT,
+        last_timestamp DATETIME,
+        PRIMARY KEY (device_id, bucket)
+    )
+'''
+
+# Rollup table -> (timestamp prefix kept, suffix), giving bucket starts in the same
+# storage format as the server's history recorder ("%Y-%m-%d %H:%M:00.000000" for minutes)
+ROLLUP_BUCKETS = {
+    "device_history_minute": (16, ":00.000000"),
+    "device_history_hour": (13, ":00:00.000000"),
+}
+
+# Indexes declared on the models (see models.py), created after the bulk load
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_room_owner_id ON room (owner_id)",
+    "CREATE INDEX IF NOT EXISTS ix_device_room_id ON device (room_id)",
+    "CREATE INDEX IF NOT EXISTS ix_device_history_device_timestamp ON device_history (device_id, timestamp)",
+]
+
 # Add a function to sanitize device type names for consistency
 def sanitize_device_type(device_type):
     """Ensure device type names are consistent and valid for MQTT topics"""
     return device_type.lower().replace(' ', '_').replace('-', '_')
 
+def count_range(text):
+    """argparse type for a count given as 'N' or 'MIN-MAX'"""
+    try:
+        low, _, high = text.partition('-')
+        low = int(low)
+        high = int(high) if high else low
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected N or MIN-MAX, got '{text}'")
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f"invalid range '{text}'")
+    return low, high
+
 def create_tables(conn):
     """Create tables if they don't exist"""
     cursor = conn.cursor()
-    
+
     # Create user table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS user (
@@ -56,7 +134,7 @@ def create_tables(conn):
         created_at DATETIME NOT NULL
     )
     ''')
-    
+
     # Create room table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS room (
@@ -66,7 +144,7 @@ def create_tables(conn):
         FOREIGN KEY (owner_id) REFERENCES user (id)
     )
     ''')
-    
+
     # Create device table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS device (
@@ -79,246 +157,298 @@ def create_tables(conn):
         FOREIGN KEY (room_id) REFERENCES room (id)
     )
     ''')
-    
-    # Create device history table for logging
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS device_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        device_id INTEGER NOT NULL,
-        status BOOLEAN,
-        value FLOAT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (device_id) REFERENCES device (id)
-    )
-    ''')
-    
+
+    # Create device history table for logging, and its rollups
+    create_history_tables(conn)
+
     conn.commit()
 
-def generate_users(conn):
-    """Generate sample users"""
-    cursor = conn.cursor()
-    
-    for user in USERS:
-        # Generate password hash
-        password_hash = generate_password_hash(user["password"])
-        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        cursor.execute(
-            "INSERT INTO user (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
-            (user["username"], user["email"], password_hash, created_at)
-        )
-    
+def create_history_tables(conn):
+    conn.execute(HISTORY_TABLE)
+    for name in ROLLUP_BUCKETS:
+        conn.execute(ROLLUP_TABLE.format(name=name))
+
+def create_indexes(conn):
+    """Build the model indexes once all rows are in, which is much faster than maintaining them per insert"""
+    for statement in INDEXES:
+        conn.execute(statement)
     conn.commit()
-    print(f"Created {len(USERS)} users.")
 
-def generate_rooms(conn, count=None):
-    """Generate sample rooms"""
-    cursor = conn.cursor()
-    
-    # Get all users
-    cursor.execute("SELECT id FROM user")
-    users = cursor.fetchall()
-    
-    # If count is not provided, use all sample rooms
-    rooms_to_create = ROOMS[:count] if count else ROOMS
-    
-    total_rooms = 0
-    
-    for user_id, in users:
-        # Create a subset of rooms for each user
-        user_rooms = random.sample(rooms_to_create, k=random.randint(3, len(rooms_to_create)))
-        
-        for room_name in user_rooms:
-            cursor.execute("INSERT INTO room (name, owner_id) VALUES (?, ?)", (room_name, user_id))
-            total_rooms += 1
-    
+def device_value(rng, device_type, status):
+    """Value depends on device type"""
+    if device_type == "thermostat" and status:
+        return round(rng.uniform(18.0, 26.0), 1)  # Temperature between 18-26°C
+    if device_type == "light" and status:
+        return rng.randint(30, 100)  # Brightness level
+    return 0
+
+def generate_users(conn, count, password):
+    """Generate sample users; all generated users share one password hash, since hashing is slow"""
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    shared_hash = generate_password_hash(password) if count > len(USERS) else None
+
+    rows = []
+    for index in range(count):
+        if index < len(USERS):
+            user = USERS[index]
+            rows.append((user["username"], user["email"], generate_password_hash(user["password"]), created_at))
+        else:
+            username = f"user{index + 1}"
+            rows.append((username, f"{username}@example.com", shared_hash, created_at))
+
+    conn.executemany(
+        "INSERT INTO user (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)", rows
+    )
     conn.commit()
-    print(f"Created {total_rooms} rooms across {len(users)} users.")
+    print(f"Created {count} users.")
 
-def generate_devices(conn, devices_per_room=(2, 6)):
+def generate_rooms(conn, rng, rooms_per_user):
+    """Generate rooms for every user, numbering room names once the sample names run out"""
+    users = [user_id for user_id, in conn.execute("SELECT id FROM user ORDER BY id")]
+
+    rows = []
+    for user_id in users:
+        num_rooms = rng.randint(*rooms_per_user)
+        names = rng.sample(ROOMS, k=min(num_rooms, len(ROOMS)))
+        for index in range(len(names), num_rooms):
+            names.append(f"{ROOMS[index % len(ROOMS)]} {index // len(ROOMS) + 1}")
+        rows.extend((name, user_id) for name in names)
+
+    conn.executemany("INSERT INTO room (name, owner_id) VALUES (?, ?)", rows)
+    conn.commit()
+    print(f"Created {len(rows)} rooms across {len(users)} users.")
+
+def generate_devices(conn, rng, devices_per_room, batch_size):
     """Generate devices for each room"""
-    cursor = conn.cursor()
-    
-    # Get all rooms
-    cursor.execute("SELECT id, name FROM room")
-    rooms = cursor.fetchall()
-    
+    device_types = list(DEVICE_TYPES.keys())
     total_devices = 0
-    
-    for room_id, room_name in rooms:
-        # Random number of devices per room
-        num_devices = random.randint(devices_per_room[0], devices_per_room[1])
-        
-        for _ in range(num_devices):
-            # Choose a random device type
-            device_type = random.choice(list(DEVICE_TYPES.keys()))
-            
-            # Choose a random device name from that type
-            device_name = random.choice(DEVICE_TYPES[device_type])
-            
-            # For similar device types in the same room, add a number
-            cursor.execute(
-                "SELECT COUNT(*) FROM device WHERE room_id = ? AND name LIKE ?", 
-                (room_id, f"{device_name}%")
-            )
-            count = cursor.fetchone()[0]
-            
-            if count > 0:
-                device_name = f"{device_name} {count + 1}"
-            
-            # Generate random status and value
-            status = random.choice([0, 1])
-            
-            # Value depends on device type
-            if device_type == "thermostat":
-                value = round(random.uniform(18.0, 26.0), 1)  # Temperature between 18-26°C
-            elif device_type == "light" and status:
-                value = random.randint(30, 100)  # Brightness level
-            else:
-                value = 0
-            
-            # Insert device
-            cursor.execute(
-                "INSERT INTO device (name, type, status, value, room_id) VALUES (?, ?, ?, ?, ?)",
-                (device_name, device_type, status, value, room_id)
-            )
-            total_devices += 1
-    
+
+    def rows():
+        nonlocal total_devices
+        for room_id, in conn.execute("SELECT id FROM room ORDER BY id").fetchall():
+            # For similar devices in the same room, add a number
+            name_counts = {}
+            for _ in range(rng.randint(*devices_per_room)):
+                device_type = rng.choice(device_types)
+                device_name = rng.choice(DEVICE_TYPES[device_type])
+                count = name_counts.get(device_name, 0)
+                name_counts[device_name] = count + 1
+                if count > 0:
+                    device_name = f"{device_name} {count + 1}"
+
+                status = rng.choice([0, 1])
+                total_devices += 1
+                yield device_name, device_type, status, device_value(rng, device_type, status), room_id
+
+    insert_batches(conn, "INSERT INTO device (name, type, status, value, room_id) VALUES (?, ?, ?, ?, ?)",
+                   rows(), batch_size)
+    print(f"Created {total_devices} devices.")
+
+def insert_batches(conn, statement, rows, batch_size):
+    """executemany() in chunks of batch_size rows, all in one transaction"""
+    count = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        conn.executemany(statement, batch)
+        count += len(batch)
     conn.commit()
-    print(f"Created {total_devices} devices across {len(rooms)} rooms.")
+    return count
 
-def generate_device_history(conn, days_back=7):
-    """Generate device usage history"""
-    cursor = conn.cursor()
-    
-    # Get all devices
-    cursor.execute("SELECT id, type FROM device")
-    devices = cursor.fetchall()
-    
-    total_history_entries = 0
-    
+def history_timestamps(days_back, interval_minutes):
+    """Sample times shared by every device, oldest first, ending at the current hour.
+
+    Written in SQLAlchemy's storage format so they sort and compare like the
+    rows the server records.
+    """
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    step = timedelta(minutes=interval_minutes)
+    samples = int(timedelta(days=days_back) / step)
+    return [(end - step * (samples - index)).strftime("%Y-%m-%d %H:%M:%S.000000") for index in range(samples)]
+
+def history_rows(devices, timestamps, seed):
+    """Yield (device_id, status, value, timestamp) for every device at every sample time.
+
+    Each device gets its own random stream derived from the seed, so the rows
+    don't depend on how devices are split across worker processes.
+    """
     for device_id, device_type in devices:
-        # Generate between 10-30 history entries per device
-        num_entries = random.randint(10, 30)
-        
-        for _ in range(num_entries):
-            # Random date within the last week
-            days_ago = random.uniform(0, days_back)
-            timestamp = datetime.now() - timedelta(days=days_ago)
-            formatted_timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Random status
-            status = random.choice([0, 1])
-            
-            # Value depends on device type
-            if device_type == "thermostat" and status:
-                value = round(random.uniform(18.0, 26.0), 1)
-            elif device_type == "light" and status:
-                value = random.randint(30, 100)
-            else:
-                value = 0
-            
-            # Insert history entry
-            cursor.execute(
-                "INSERT INTO device_history (device_id, status, value, timestamp) VALUES (?, ?, ?, ?)",
-                (device_id, status, value, formatted_timestamp)
-            )
-            total_history_entries += 1
-    
+        rng = random.Random(f"{seed}:{device_id}")
+        status = rng.choice([0, 1])
+        for timestamp in timestamps:
+            if rng.random() < STATUS_CHANGE_PROBABILITY:
+                status = 1 - status
+            yield device_id, status, device_value(rng, device_type, status), timestamp
+
+INSERT_HISTORY = "INSERT INTO device_history (device_id, status, value, timestamp) VALUES (?, ?, ?, ?)"
+
+INSERT_ROLLUP = ("INSERT INTO {name} (device_id, bucket, count, value_count, value_sum, value_min, value_max, "
+                 "last_value, last_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+def rollup_rows(device_id, rows, prefix, suffix):
+    """Aggregate one device's history rows (oldest first) into one rollup row per bucket.
+
+    Generated values are never null, so every row counts towards the value aggregates.
+    """
+    rollups = []
+    bucket = None
+    count = value_sum = value_min = value_max = last_value = last_timestamp = None
+    for _, _, value, timestamp in rows:
+        key = timestamp[:prefix]
+        if key == bucket:
+            count += 1
+            value_sum += value
+            value_min = min(value_min, value)
+            value_max = max(value_max, value)
+        else:
+            if bucket is not None:
+                rollups.append((device_id, bucket + suffix, count, count, value_sum, value_min, value_max,
+                                last_value, last_timestamp))
+            bucket, count, value_sum, value_min, value_max = key, 1, value, value, value
+        last_value, last_timestamp = value, timestamp
+    if bucket is not None:
+        rollups.append((device_id, bucket + suffix, count, count, value_sum, value_min, value_max,
+                        last_value, last_timestamp))
+    return rollups
+
+def write_history(conn, devices, timestamps, seed, batch_size):
+    """Insert the history of devices and its rollups, flushing every batch_size history rows; returns the row count"""
+    statements = [INSERT_HISTORY] + [INSERT_ROLLUP.format(name=name) for name in ROLLUP_BUCKETS]
+    batches = [[] for _ in statements]
+    count = 0
+
+    def flush():
+        for statement, batch in zip(statements, batches):
+            conn.executemany(statement, batch)
+            batch.clear()
+
+    for device_id, rows in itertools.groupby(history_rows(devices, timestamps, seed), key=itemgetter(0)):
+        rows = list(rows)
+        batches[0].extend(rows)
+        for batch, (prefix, suffix) in zip(batches[1:], ROLLUP_BUCKETS.values()):
+            batch.extend(rollup_rows(device_id, rows, prefix, suffix))
+        count += len(rows)
+        if len(batches[0]) >= batch_size:
+            flush()
+    flush()
     conn.commit()
-    print(f"Created {total_history_entries} history entries.")
+    return count
+
+def bulk_load_pragmas(conn):
+    # The database is being created from scratch: a crash means running the generator again
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+
+def _write_history_shard(job):
+    """Worker process: write the history of a slice of devices into its own shard database"""
+    path, devices, timestamps, seed, batch_size = job
+    conn = sqlite3.connect(path)
+    bulk_load_pragmas(conn)
+    create_history_tables(conn)
+    count = write_history(conn, devices, timestamps, seed, batch_size)
+    conn.close()
+    return path, count
+
+def generate_device_history(conn, days_back, interval_minutes, seed, workers, batch_size):
+    """Generate device usage history and its rollups, in parallel shards when workers > 1"""
+    devices = conn.execute("SELECT id, type FROM device ORDER BY id").fetchall()
+    timestamps = history_timestamps(days_back, interval_minutes)
+    if not devices or not timestamps:
+        print("Created 0 history entries.")
+        return
+
+    if workers <= 1:
+        total = write_history(conn, devices, timestamps, seed, batch_size)
+        print(f"Created {total} history entries.")
+        return
+
+    # Shards live next to the database so the final copy stays on one filesystem
+    shard_dir = tempfile.mkdtemp(prefix='history-shards-', dir=os.path.dirname(os.path.abspath(DB_PATH)))
+    chunk = -(-len(devices) // (workers * 4))  # several chunks per worker to balance the load
+    jobs = [(os.path.join(shard_dir, f"shard-{index}.db"), devices[start:start + chunk], timestamps, seed, batch_size)
+            for index, start in enumerate(range(0, len(devices), chunk))]
+
+    total = 0
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            # imap keeps shard order, so history ids follow device ids as in a single process run
+            for path, count in pool.imap(_write_history_shard, jobs):
+                conn.execute("ATTACH DATABASE ? AS shard", (path,))
+                conn.execute("INSERT INTO device_history (device_id, status, value, timestamp) "
+                             "SELECT device_id, status, value, timestamp FROM shard.device_history")
+                for name in ROLLUP_BUCKETS:
+                    conn.execute(f"INSERT INTO {name} SELECT * FROM shard.{name}")
+                conn.commit()
+                conn.execute("DETACH DATABASE shard")
+                os.remove(path)
+                total += count
+    finally:
+        for path, *_ in jobs:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(shard_dir)
+    print(f"Created {total} history entries using {workers} processes.")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DB_PATH, help="database file (default: smart_home.db)")
+    parser.add_argument('--force', action='store_true', help="delete the database first if it exists")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument('--users', type=int, default=len(USERS), help="number of users (default: 3)")
+    parser.add_argument('--password', default='password', help="password of generated users beyond the samples")
+    parser.add_argument('--rooms-per-user', type=count_range, default=(3, len(ROOMS)), help="N or MIN-MAX (default: 3-10)")
+    parser.add_argument('--devices-per-room', type=count_range, default=(2, 6), help="N or MIN-MAX (default: 2-6)")
+    parser.add_argument('--history-days', type=float, default=7, help="days of history per device (default: 7, 0 for none)")
+    parser.add_argument('--history-interval', type=float, default=60, help="minutes between history samples (default: 60)")
+    parser.add_argument('--workers', type=int, default=1, help="processes generating history (default: 1)")
+    parser.add_argument('--batch-size', type=int, default=50000, help="rows per executemany call (default: 50000)")
+    args = parser.parse_args(argv)
+    if args.history_interval <= 0:
+        parser.error("--history-interval must be positive")
+    if args.users < 1 or args.workers < 1 or args.batch_size < 1:
+        parser.error("--users, --workers and --batch-size must be at least 1")
+    return args
+
+def main(argv=None):
     """Main function to generate all data"""
-    global DB_PATH  # Add this line to indicate we want to modify the global DB_PATH
-    
-    # Check if database exists and delete if it does
+    global DB_PATH
+    args = parse_args(argv)
+    DB_PATH = os.path.abspath(args.db)
+
+    # Never prompt: an existing database is only replaced with --force
     if os.path.exists(DB_PATH):
-        confirm = input(f"Database at {DB_PATH} already exists. Delete and recreate? (y/n): ")
-        if confirm.lower() == 'y':
-            try:
-                os.remove(DB_PATH)
-                print("Database deleted.")
-            except PermissionError:
-                print(f"Error: Cannot delete database as it's being used by another process.")
-                print("Options:")
-                print("1. Close any applications using the database and try again")
-                print("2. Create a database with a different name")
-                print("3. Continue with existing database")
-                
-                choice = input("Enter your choice (1/2/3): ")
-                
-                if choice == '1':
-                    print("Please close all applications using the database and press Enter to try again...")
-                    input()
-                    try:
-                        os.remove(DB_PATH)
-                        print("Database deleted.")
-                    except PermissionError:
-                        print("Still cannot delete database. Using existing database.")
-                elif choice == '2':
-                    new_name = input("Enter new database name (without .db extension): ")
-                    DB_PATH = os.path.join(BASE_DIR, f"{new_name}.db")
-                    print(f"Using new database path: {DB_PATH}")
-                else:
-                    print("Using existing database.")
-        else:
-            print("Using existing database.")
-    
+        if not args.force:
+            print(f"Database at {DB_PATH} already exists. Use --force to delete and recreate it.")
+            return 1
+        try:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(DB_PATH + suffix):
+                    os.remove(DB_PATH + suffix)
+        except PermissionError:
+            print("Error: Cannot delete database as it's being used by another process.")
+            return 1
+        print("Database deleted.")
+
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+
     # Connect to database
     conn = sqlite3.connect(DB_PATH)
-    
-    # Create tables
+    bulk_load_pragmas(conn)
     create_tables(conn)
-    
-    # Check if users already exist
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM user")
-    user_count = cursor.fetchone()[0]
-    
-    if user_count == 0:
-        # Generate users
-        generate_users(conn)
-        
-        # Generate rooms
-        generate_rooms(conn)
-        
-        # Generate devices
-        generate_devices(conn)
-        
-        # Generate device history
-        generate_device_history(conn)
-    else:
-        print(f"Database already contains {user_count} users.")
-        
-        # Check rooms
-        cursor.execute("SELECT COUNT(*) FROM room")
-        room_count = cursor.fetchone()[0]
-        
-        if room_count == 0:
-            # Generate rooms
-            generate_rooms(conn)
-            
-            # Generate devices
-            generate_devices(conn)
-            
-            # Generate device history
-            generate_device_history(conn)
-        else:
-            print(f"Database already contains {room_count} rooms.")
-            
-            # Option to regenerate just devices
-            confirm = input("Regenerate devices and history? (y/n): ")
-            if confirm.lower() == 'y':
-                cursor.execute("DELETE FROM device_history")
-                cursor.execute("DELETE FROM device")
-                conn.commit()
-                generate_devices(conn)
-                generate_device_history(conn)
-    
+
+    generate_users(conn, args.users, args.password)
+    generate_rooms(conn, rng, args.rooms_per_user)
+    generate_devices(conn, rng, args.devices_per_room, args.batch_size)
+    generate_device_history(conn, args.history_days, args.history_interval, args.seed, args.workers, args.batch_size)
+    create_indexes(conn)
+
     # Close connection
     conn.close()
-    print(f"Database created successfully at {DB_PATH}")
+    print(f"Database created successfully at {DB_PATH} in {time.perf_counter() - started:.1f}s")
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
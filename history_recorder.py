@@ -0,0 +1,173 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from models import db, DeviceHistory
+from history_rollups import apply_rollups
+from storage import writer
+
+log = logging.getLogger(__name__)
+
+# Sentinel pushed onto the queue to wake the writer thread on shutdown
+_STOP = object()
+
+recorder = None
+
+class HistoryRecorder:
+    """Write-behind buffer that persists device state changes to DeviceHistory.
+
+    Producers (REST handlers, the MQTT ingest path) only enqueue a small tuple.
+    A single background thread drains the queue and inserts rows in batches,
+    flushing when either ``batch_size`` rows are pending or ``flush_interval``
+    seconds have passed since the first pending row.
+    """
+
+    def __init__(self, app, batch_size=500, flush_interval=1.0, max_queue=10000, enqueue_timeout=0.05):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopped = threading.Event()
+        self.recorded = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="history-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, device_id, status, value, timestamp=None):
+        """Queue one state change. Returns False if the buffer stayed full."""
+        if self._stopped.is_set():
+            return False
+        item = (device_id, status, value, timestamp or datetime.utcnow())
+        try:
+            # Bounded wait: producers slow down briefly when the writer falls
+            # behind, but never stall indefinitely (the MQTT thread calls this)
+            self._queue.put(item, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "pending": self.pending(),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches
+        }
+
+    def stop(self, timeout=10):
+        """Stop accepting rows, flush everything still buffered and join the writer."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                # Drain whatever was enqueued before the stop request
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+                self._flush(batch)
+                return
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        rows = [
+            {"device_id": device_id, "status": status, "value": value, "timestamp": timestamp}
+            for device_id, status, value, timestamp in batch
+        ]
+        with self.app.app_context():
+            try:
+                # One executemany inside one transaction for the whole batch,
+                # with the minute/hour rollups updated in the same commit
+                with writer:
+                    db.session.execute(DeviceHistory.__table__.insert(), rows)
+                    apply_rollups(rows)
+                    db.session.commit()
+                self.recorded += len(rows)
+                self.batches += 1
+            except Exception as e:
+                db.session.rollback()
+                self.failed += len(rows)
+                log.error("Error writing %d device history rows: %s", len(rows), e)
+            finally:
+                db.session.remove()
+
+def setup_history_recorder(app):
+    """Create and start the process-wide history recorder"""
+    global recorder
+
+    if recorder:
+        recorder.stop()
+
+    recorder = HistoryRecorder(
+        app,
+        batch_size=app.config.get('HISTORY_BATCH_SIZE', 500),
+        flush_interval=app.config.get('HISTORY_FLUSH_INTERVAL', 1.0),
+        max_queue=app.config.get('HISTORY_QUEUE_SIZE', 10000),
+        enqueue_timeout=app.config.get('HISTORY_ENQUEUE_TIMEOUT', 0.05)
+    )
+    recorder.start()
+    return recorder
+
+def record_device_state(device):
+    """Queue the current state of a device for the history table"""
+    return record_history(device.id, device.status, device.value)
+
+def record_history(device_id, status, value, timestamp=None):
+    """Queue one history row; timestamp defaults to now (UTC)"""
+    if not recorder:
+        return False
+    return recorder.record(device_id, status, value, timestamp)
+
+def shutdown_history_recorder():
+    """Flush buffered history rows; registered to run at process exit"""
+    if recorder:
+        recorder.stop()
+
+atexit.register(shutdown_history_recorder)
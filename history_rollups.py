@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import bindparam, case, func, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, DeviceHistory, DeviceHistoryMinute, DeviceHistoryHour
+from storage import writer
+
+log = logging.getLogger(__name__)
+
+BUCKETS = ("minute", "hour", "day")
+
+# Pick the coarsest useful bucket when the client doesn't ask for one
+AUTO_BUCKET_LIMITS = (
+    (timedelta(hours=6), "minute"),
+    (timedelta(days=14), "hour"),
+)
+
+def truncate_minute(ts):
+    return ts.replace(second=0, microsecond=0)
+
+def truncate_hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def truncate_day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+_TRUNCATE = {"minute": truncate_minute, "hour": truncate_hour, "day": truncate_day}
+
+def _aggregate(rows, truncate):
+    """Collapse raw history rows into one rollup row per (device, bucket)"""
+    buckets = {}
+    for row in rows:
+        key = (row["device_id"], truncate(row["timestamp"]))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = buckets[key] = {
+                "device_id": key[0],
+                "bucket": key[1],
+                "count": 0,
+                "value_count": 0,
+                "value_sum": 0.0,
+                "value_min": None,
+                "value_max": None,
+                "last_value": None,
+                "last_timestamp": None
+            }
+        agg["count"] += 1
+        value = row["value"]
+        if value is not None:
+            agg["value_count"] += 1
+            agg["value_sum"] += value
+            agg["value_min"] = value if agg["value_min"] is None else min(agg["value_min"], value)
+            agg["value_max"] = value if agg["value_max"] is None else max(agg["value_max"], value)
+        if agg["last_timestamp"] is None or row["timestamp"] >= agg["last_timestamp"]:
+            agg["last_timestamp"] = row["timestamp"]
+            agg["last_value"] = value
+    return list(buckets.values())
+
+def _upsert(model, rollup_rows):
+    """Merge partial aggregates into a rollup table with one executemany"""
+    table = model.__table__
+    stmt = sqlite_insert(table)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.device_id, table.c.bucket],
+        set_={
+            "count": table.c.count + new.count,
+            "value_count": table.c.value_count + new.value_count,
+            "value_sum": table.c.value_sum + new.value_sum,
+            # SQLite's scalar min()/max() return NULL if any argument is NULL
+            "value_min": func.min(func.coalesce(table.c.value_min, new.value_min),
+                                  func.coalesce(new.value_min, table.c.value_min)),
+            "value_max": func.max(func.coalesce(table.c.value_max, new.value_max),
+                                  func.coalesce(new.value_max, table.c.value_max)),
+            "last_value": case((new.last_timestamp >= table.c.last_timestamp, new.last_value),
+                               else_=table.c.last_value),
+            "last_timestamp": func.max(new.last_timestamp, table.c.last_timestamp)
+        }
+    )
+    db.session.execute(stmt, rollup_rows)
+
+def apply_rollups(rows):
+    """Fold a batch of new history rows into the minute and hour rollups.
+
+    Runs inside the caller's transaction so raw rows and rollups commit together.
+    """
+    if not rows:
+        return
+    _upsert(DeviceHistoryMinute, _aggregate(rows, truncate_minute))
+    _upsert(DeviceHistoryHour, _aggregate(rows, truncate_hour))
+
+def delete_device_history(device_id):
+    """Delete a device's history and rollup rows; call inside the writer, the caller commits"""
+    for model in (DeviceHistory, DeviceHistoryMinute, DeviceHistoryHour):
+        db.session.query(model).filter(model.device_id == device_id).delete(synchronize_session=False)
+
+def devices_missing_rollups():
+    """Ids of devices with history older than their first minute rollup (or no rollup at all)"""
+    # Two index seeks per device; a device is backfilled in one transaction,
+    # so its rollups either cover all of its history or start at its newest rows
+    return [device_id for (device_id,) in db.session.execute(text("""
+        SELECT d.id FROM device d
+        WHERE (SELECT MIN(h.timestamp) FROM device_history h WHERE h.device_id = d.id)
+              < COALESCE((SELECT MIN(m.bucket) FROM device_history_minute m WHERE m.device_id = d.id), '9999')
+        ORDER BY d.id
+    """))]
+
+def backfill_rollups(device_ids):
+    """Rebuild both rollup tables of the given devices from device_history; call inside the writer, the caller commits"""
+    params = {"ids": list(device_ids)}
+    ids = bindparam("ids", expanding=True)
+    db.session.execute(DeviceHistoryMinute.__table__.delete().where(DeviceHistoryMinute.device_id.in_(device_ids)))
+    db.session.execute(DeviceHistoryHour.__table__.delete().where(DeviceHistoryHour.device_id.in_(device_ids)))
+
+    # Timestamps are written in SQLAlchemy's storage format so rows created here
+    # and rows upserted by apply_rollups() collide on the same primary key
+    db.session.execute(text("""
+        INSERT INTO device_history_minute
+            (device_id, bucket, count, value_count, value_sum, value_min, value_max, last_timestamp)
+        SELECT device_id, strftime('%Y-%m-%d %H:%M:00.000000', timestamp),
+               COUNT(*), COUNT(value), COALESCE(SUM(value), 0), MIN(value), MAX(value), MAX(timestamp)
+        FROM device_history
+        WHERE device_id IN :ids AND timestamp IS NOT NULL
+        GROUP BY device_id, strftime('%Y-%m-%d %H:%M:00.000000', timestamp)
+    """).bindparams(ids), params)
+    db.session.execute(text("""
+        UPDATE device_history_minute SET last_value = (
+            SELECT h.value FROM device_history h
+            WHERE h.device_id = device_history_minute.device_id
+              AND h.timestamp = device_history_minute.last_timestamp
+            ORDER BY h.id DESC LIMIT 1)
+        WHERE device_id IN :ids
+    """).bindparams(ids), params)
+    db.session.execute(text("""
+        INSERT INTO device_history_hour
+            (device_id, bucket, count, value_count, value_sum, value_min, value_max, last_timestamp)
+        SELECT device_id, strftime('%Y-%m-%d %H:00:00.000000', bucket),
+               SUM(count), SUM(value_count), SUM(value_sum), MIN(value_min), MAX(value_max), MAX(last_timestamp)
+        FROM device_history_minute
+        WHERE device_id IN :ids
+        GROUP BY device_id, strftime('%Y-%m-%d %H:00:00.000000', bucket)
+    """).bindparams(ids), params)
+    db.session.execute(text("""
+        UPDATE device_history_hour SET last_value = (
+            SELECT m.last_value FROM device_history_minute m
+            WHERE m.device_id = device_history_hour.device_id
+              AND m.last_timestamp = device_history_hour.last_timestamp
+            LIMIT 1)
+        WHERE device_id IN :ids
+    """).bindparams(ids), params)
+
+def backfill_missing_rollups(chunk_size=10):
+    """Backfill every device returned by devices_missing_rollups(), chunk_size devices per transaction.
+
+    Each chunk holds the writer only briefly, so the history recorder keeps
+    writing in between. Rows it records for a device before that device's
+    chunk are recounted from device_history, so nothing is counted twice.
+    Returns the number of devices backfilled.
+    """
+    pending = devices_missing_rollups()
+    db.session.rollback()
+    if not pending:
+        return 0
+    log.info("Building device history rollups for %d devices in the background", len(pending))
+    started = time.monotonic()
+    done = 0
+    for offset in range(0, len(pending), chunk_size):
+        # Another server process may have backfilled some of these since
+        missing = set(devices_missing_rollups())
+        db.session.rollback()
+        chunk = [device_id for device_id in pending[offset:offset + chunk_size] if device_id in missing]
+        if not chunk:
+            continue
+        with writer:
+            backfill_rollups(chunk)
+            db.session.commit()
+        done += len(chunk)
+    log.info("Device history rollups built for %d devices in %.1fs", done, time.monotonic() - started)
+    return done
+
+def setup_rollup_backfill(app):
+    """Start a background thread that backfills rollups for history that was never aggregated (e.g. generate_data.py)"""
+    def run():
+        with app.app_context():
+            try:
+                backfill_missing_rollups(app.config.get('ROLLUP_BACKFILL_CHUNK', 10))
+            except Exception as e:
+                db.session.rollback()
+                log.error("Device history rollup backfill failed: %s", e)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run, name="rollup-backfill", daemon=True)
+    thread.start()
+    return thread
+
+def choose_bucket(start, end):
+    span = end - start
+    for limit, bucket in AUTO_BUCKET_LIMITS:
+        if span <= limit:
+            return bucket
+    return "day"
+
+def query_history(device_id, start, end, bucket):
+    """Return min/max/avg/last per bucket for one device between start and end"""
+    model = DeviceHistoryMinute if bucket == "minute" else DeviceHistoryHour
+    rows = db.session.query(
+        model.bucket, model.count, model.value_count, model.value_sum,
+        model.value_min, model.value_max, model.last_value
+    ).filter(
+        model.device_id == device_id,
+        model.bucket >= _TRUNCATE[bucket](start),
+        model.bucket < end
+    ).order_by(model.bucket).all()
+
+    points = []
+    truncate = _TRUNCATE[bucket]
+    for ts, count, value_count, value_sum, value_min, value_max, last_value in rows:
+        ts = truncate(ts)
+        if points and points[-1]["_bucket"] == ts:
+            # Day buckets merge consecutive hour rows
+            point = points[-1]
+            point["count"] += count
+            point["_value_count"] += value_count
+            point["_value_sum"] += value_sum
+            if value_min is not None:
+                point["min"] = value_min if point["min"] is None else min(point["min"], value_min)
+            if value_max is not None:
+                point["max"] = value_max if point["max"] is None else max(point["max"], value_max)
+            point["last"] = last_value
+        else:
+            points.append({
+                "_bucket": ts,
+                "count": count,
+                "_value_count": value_count,
+                "_value_sum": value_sum,
+                "min": value_min,
+                "max": value_max,
+                "last": last_value
+            })
+
+    return [{
+        "timestamp": point["_bucket"].isoformat(),
+        "min": point["min"],
+        "max": point["max"],
+        "avg": point["_value_sum"] / point["_value_count"] if point["_value_count"] else None,
+        "last": point["last"],
+        "count": point["count"]
+    } for point in points]
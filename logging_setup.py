@@ -0,0 +1,166 @@
+"""Leveled, structured logging that writes on a background thread.
+
+Every module logs through ``logging.getLogger(__name__)``. setup_logging()
+installs one handler on the root logger that only puts records on a
+bounded queue; a listener thread formats and writes them, so the MQTT
+network thread and request threads never wait on stdout. Fields passed as
+``extra={...}`` are written as key=value pairs, or as JSON fields with
+LOG_FORMAT=json.
+
+Per-message lines go to the ``<module>.messages`` loggers: only a
+LOG_SAMPLE_RATE fraction of their debug lines is written, and their
+warnings are capped at LOG_WARNINGS_PER_SECOND.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Loggers that get a line per MQTT message
+MESSAGE_LOGGERS = ('mqtt_client.messages', 'mqtt_ingest.messages')
+
+listener = None
+queue_handler = None
+
+def _field_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'replace')
+    return value
+
+def record_fields(record):
+    """The extra={...} fields of a record"""
+    return {key: _field_value(value) for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+class TextFormatter(logging.Formatter):
+    """``time LEVEL logger: message key=value ...``"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class MessageLogFilter(logging.Filter):
+    """Keeps per-message logging cheap under load.
+
+    Only a ``sample_rate`` fraction of DEBUG and INFO records is kept (tagged
+    with that rate). At most ``warnings_per_second`` WARNING records are kept
+    per second, so a burst of bad or dropped messages can't flood the log.
+    Errors always pass.
+    """
+
+    def __init__(self, sample_rate, warnings_per_second):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.warnings_per_second = warnings_per_second
+        self._window = None
+        self._warnings = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        if record.levelno >= logging.WARNING:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._warnings = 0
+            self._warnings += 1
+            return self._warnings <= self.warnings_per_second
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        record.sample_rate = self.sample_rate
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: records that don't fit in the queue are counted and dropped.
+
+    Records are queued unformatted; the listener thread does the formatting.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging(app):
+    """Route all logging through the background writer at LOG_LEVEL (idempotent)"""
+    global listener, queue_handler
+
+    level = logging.getLevelName(str(app.config.get('LOG_LEVEL', 'INFO')).upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    # The filter sits on the per-message loggers themselves, so records it rejects are never queued
+    for name in MESSAGE_LOGGERS:
+        message_logger = logging.getLogger(name)
+        for existing in [f for f in message_logger.filters if isinstance(f, MessageLogFilter)]:
+            message_logger.removeFilter(existing)
+        message_logger.addFilter(MessageLogFilter(app.config.get('LOG_SAMPLE_RATE', 0.01),
+                                                  app.config.get('LOG_WARNINGS_PER_SECOND', 10)))
+
+    if listener:
+        return listener
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if app.config.get('LOG_FORMAT') == 'json' else TextFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000)))
+    root.addHandler(queue_handler)
+    listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def dropped_records():
+    return queue_handler.dropped if queue_handler else 0
+
+def shutdown_logging():
+    """Write out queued records; registered to run at process exit"""
+    global listener, queue_handler
+    if listener:
+        listener.stop()
+        # Whatever other exit handlers log after this is written directly
+        root = logging.getLogger()
+        root.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            root.addHandler(handler)
+        listener = None
+        queue_handler = None
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,274 @@
+"""Process metrics in the Prometheus text exposition format, served at GET /metrics.
+
+Counters and histograms are updated in place by the code they measure.
+Values that other modules already keep (queue depths, reconnects, drops)
+are read from those modules when /metrics is scraped instead of being
+counted twice.
+"""
+import bisect
+import logging
+import threading
+import time
+from flask import Response, g, request
+from sqlalchemy import event
+from models import db
+import logging_setup
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds; requests and SQL statements live on very different scales
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Statement kinds used as the SQL operation label; anything else is 'OTHER'
+SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'CREATE'}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in sorted(items):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=HTTP_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(counts), total, count)) for labels, (counts, total, count) in self._series.items()]
+        for label_values, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.labels, label_values, (('le', _format_value(float(bound))),)), cumulative)
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), count
+
+class CallbackMetric:
+    """Counter or gauge whose value is read from elsewhere at scrape time.
+
+    ``read()`` returns a number, or a dict of {label value tuple: number}
+    when the metric has labels.
+    """
+
+    def __init__(self, name, help_text, kind, read, labels=()):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._read = read
+
+    def samples(self):
+        try:
+            values = self._read()
+        except Exception as e:
+            log.error("Error reading metric %s: %s", self.name, e)
+            return
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=HTTP_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, kind, read, labels=()):
+        return self.register(CallbackMetric(name, help_text, kind, read, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# HTTP
+http_request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce the response, by route template',
+    ('method', 'route', 'status'))
+
+# Database
+sql_statement_duration = registry.histogram(
+    'db_statement_duration_seconds', 'SQL statement execution time, by statement kind',
+    ('operation',), SQL_BUCKETS)
+sql_errors = registry.counter('db_statement_errors_total', 'SQL statements that raised', ('operation',))
+
+# MQTT
+mqtt_received = registry.counter(
+    'mqtt_messages_received_total', 'MQTT messages received, by topic family', ('family',))
+mqtt_published = registry.counter(
+    'mqtt_messages_published_total', 'MQTT messages handed to the broker connection, by topic family', ('family',))
+mqtt_publish_failures = registry.counter(
+    'mqtt_publish_failures_total', 'MQTT publishes the client refused or that raised, by topic family', ('family',))
+
+def topic_family(topic, prefix):
+    """Low-cardinality label for a topic: its first level below the prefix.
+
+    Device type levels of the legacy topics (light/1/status, ...) are all
+    reported as 'legacy'.
+    """
+    if not topic.startswith(prefix):
+        return 'other'
+    first = topic[len(prefix):].split('/', 1)[0]
+    if first in ('devices', 'control', 'all', 'system'):
+        return first
+    return 'legacy'
+
+def _sql_operation(statement):
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return operation if operation in SQL_OPERATIONS else 'OTHER'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_start'].pop()
+    sql_statement_duration.observe(time.perf_counter() - started, _sql_operation(statement))
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get('metrics_query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+    sql_errors.inc(_sql_operation(exception_context.statement or ''))
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        # The route template, not the path, so /api/devices/1 and /api/devices/2 share a series
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_duration.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+def _register_runtime_metrics():
+    # Imported here: these modules import metrics.py for their own counters
+    import mqtt_client
+    import history_recorder
+    from storage import writer
+    from event_hub import event_hub
+
+    registry.callback('mqtt_connected', 'Whether the broker connection is up', 'gauge',
+                      lambda: 1 if mqtt_client._is_connected() else 0)
+    registry.callback('mqtt_reconnects_total', 'Successful reconnects after the first connect', 'counter',
+                      lambda: mqtt_client.connection.reconnects if mqtt_client.connection else 0)
+    registry.callback('mqtt_outbound_queue_depth', 'Device updates waiting for the publisher thread', 'gauge',
+                      lambda: mqtt_client.publisher.queue_depth() if mqtt_client.publisher else 0)
+    registry.callback('mqtt_outbound_pending', 'Device updates deferred while the broker is unreachable', 'gauge',
+                      lambda: mqtt_client.publisher.pending_count() if mqtt_client.publisher else 0)
+    registry.callback('mqtt_outbound_dropped_total', 'Device updates dropped because the outbound queue was full',
+                      'counter', lambda: mqtt_client.publisher.dropped if mqtt_client.publisher else 0)
+    registry.callback('mqtt_ingest_queue_depth', 'Inbound commands waiting for the ingest worker', 'gauge',
+                      lambda: mqtt_client.ingest_worker.queue_depth() if mqtt_client.ingest_worker else 0)
+    registry.callback('mqtt_ingest_dropped_total', 'Inbound commands dropped because the ingest queue was full',
+                      'counter', lambda: mqtt_client.ingest_worker.dropped if mqtt_client.ingest_worker else 0)
+    registry.callback('mqtt_suppressed_total', 'Publishes and inbound messages skipped, by reason', 'counter',
+                      lambda: {('unchanged',): mqtt_client.suppressed_publishes,
+                               ('echo',): mqtt_client.suppressed_echoes,
+                               ('stale',): mqtt_client.suppressed_stale},
+                      ('reason',))
+    registry.callback('history_queue_depth', 'Device history rows waiting to be written', 'gauge',
+                      lambda: history_recorder.recorder.pending() if history_recorder.recorder else 0)
+    registry.callback('history_dropped_total', 'Device history rows dropped because the buffer stayed full',
+                      'counter', lambda: history_recorder.recorder.dropped if history_recorder.recorder else 0)
+    registry.callback('db_writer_waiting', 'Threads queued for the database writer', 'gauge', writer.waiting)
+    registry.callback('stream_clients', 'Open /api/stream connections', 'gauge', event_hub.client_count)
+    registry.callback('log_records_dropped_total', 'Log records dropped because the log queue was full', 'counter',
+                      logging_setup.dropped_records)
+
+def setup_metrics(app):
+    """Time every request and SQL statement and serve /metrics (call inside an app context)"""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    _register_runtime_metrics()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -20,11 +20,27 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+class RefreshToken(db.Model):
+    """Long-lived token that is exchanged for new access tokens; only its SHA-256 is stored.
+
+    Tokens issued from the same login share a family_id. Each refresh revokes
+    the presented token and issues its successor, so presenting a revoked
+    token means it was copied, and the whole family is revoked.
+    """
+    __tablename__ = 'refresh_token'
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    family_id = db.Column(db.String(32), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
 class Room(db.Model):
     __tablename__ = 'room'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     devices = db.relationship('Device', backref='room', lazy=True)
 
 class Device(db.Model):
@@ -34,13 +50,43 @@ class Device(db.Model):
     type = db.Column(db.String(50), nullable=False)
     status = db.Column(db.Boolean, default=False)
     value = db.Column(db.Float, default=0)  # Changed from Integer to Float
-    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
     history = db.relationship('DeviceHistory', backref='device', lazy=True)
 
 class DeviceHistory(db.Model):
     __tablename__ = 'device_history'
+    # Range scans are always per device and ordered by time
+    __table_args__ = (db.Index('ix_device_history_device_timestamp', 'device_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
     status = db.Column(db.Boolean, nullable=True)
     value = db.Column(db.Float, nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+class HistoryRollupMixin:
+    """Pre-aggregated DeviceHistory values for one device and one time bucket"""
+    device_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)  # start of the bucket
+    count = db.Column(db.Integer, nullable=False, default=0)  # history rows in the bucket
+    value_count = db.Column(db.Integer, nullable=False, default=0)  # rows with a non-null value
+    value_sum = db.Column(db.Float, nullable=False, default=0)
+    value_min = db.Column(db.Float, nullable=True)
+    value_max = db.Column(db.Float, nullable=True)
+    last_value = db.Column(db.Float, nullable=True)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+
+class DeviceHistoryMinute(HistoryRollupMixin, db.Model):
+    __tablename__ = 'device_history_minute'
+
+class DeviceHistoryHour(HistoryRollupMixin, db.Model):
+    __tablename__ = 'device_history_hour'
+
+def ensure_indexes():
+    """Create indexes declared on the models that are missing from an existing database.
+
+    db.create_all() only creates indexes together with new tables, so databases
+    created before an index was added would otherwise never get it.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
\ No newline at end of file
@@ -1,13 +1,31 @@
+import atexit
 import json
+import logging
 import os
 import paho.mqtt.client as mqtt
+import tempfile
+import threading
 import time
+import uuid
 from dotenv import load_dotenv
-from models import db, Device
+from mqtt_publisher import OutboundPublisher, PUBLISH_DROPPED, PUBLISH_UNCHANGED
+from history_recorder import record_history
+from mqtt_ingest import IngestWorker
+from mqtt_connection import MqttConnectionManager, CONNECT_RESULTS
+from event_hub import event_hub
+from serializers import device_payload, encode, decode
+from repository import DEVICE_FIELDS
+from device_cache import device_cache
+from election import FileLockElection
+from metrics import mqtt_received, mqtt_published, mqtt_publish_failures, topic_family
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger(__name__)
+# One line per MQTT message; only a sample is written (see logging_setup.py)
+message_log = logging.getLogger(__name__ + '.messages')
+
 # MQTT Configuration
 MQTT_BROKER_URL = os.getenv('MQTT_BROKER_URL', 'localhost')  # Fixed: Use getenv correctly with default value
 MQTT_BROKER_PORT = int(os.getenv('MQTT_BROKER_PORT', 1883))
@@ -15,20 +33,57 @@ MQTT_USERNAME = os.getenv('MQTT_USERNAME', '')  # Username can be empty for loca
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD', '')  # Password can be empty for local mosquitto without auth
 MQTT_CLIENT_ID = os.getenv('MQTT_CLIENT_ID', f'smart_home_app_{int(time.time())}')
 MQTT_TOPIC_PREFIX = "smart-home/"
-MQTT_RECONNECT_DELAY = 5  # seconds to wait before reconnect attempts
-MQTT_CONNECTION_TIMEOUT = 10  # seconds to wait for connection
+MQTT_RECONNECT_DELAY = 5  # seconds between publisher retries while the broker is down
+MQTT_RECONNECT_MIN_DELAY = int(os.getenv('MQTT_RECONNECT_MIN_DELAY', 1))  # first reconnect backoff (seconds)
+MQTT_RECONNECT_MAX_DELAY = int(os.getenv('MQTT_RECONNECT_MAX_DELAY', 30))  # backoff ceiling (seconds)
+MQTT_KEEPALIVE = 60
+MQTT_OUTBOUND_QUEUE_SIZE = int(os.getenv('MQTT_OUTBOUND_QUEUE_SIZE', 1000))  # device updates waiting for the publisher
+MQTT_INGEST_QUEUE_SIZE = int(os.getenv('MQTT_INGEST_QUEUE_SIZE', 10000))  # inbound messages waiting for the ingest worker
+MQTT_INGEST_BATCH_SIZE = int(os.getenv('MQTT_INGEST_BATCH_SIZE', 500))  # max messages applied per commit
+MQTT_INGEST_BATCH_WAIT = float(os.getenv('MQTT_INGEST_BATCH_WAIT', 0.05))  # seconds to wait for a batch to fill
+# Status topics each device update is published on: any of devices, legacy, all
+MQTT_PUBLISH_TOPICS = {topic.strip() for topic in os.getenv('MQTT_PUBLISH_TOPICS', 'devices,legacy,all').split(',')}
+# Tags every status this server publishes; messages carrying it are our own echoes.
+# Servers sharing one database should share the id so they ignore each other's publishes too
+MQTT_ORIGIN_ID = os.getenv('MQTT_ORIGIN_ID', 'smart-home-server')
+# With several server processes on one host only the holder of this lock subscribes to device
+# commands; the others publish only and take over when it exits
+MQTT_SUBSCRIBER_LOCK = os.getenv('MQTT_SUBSCRIBER_LOCK', os.path.join(tempfile.gettempdir(), 'smart-home-mqtt-subscriber.lock'))
+MQTT_ELECTION_INTERVAL = float(os.getenv('MQTT_ELECTION_INTERVAL', 5))  # seconds between standby attempts to take over
+MQTT_SUPPRESS_UNCHANGED = os.getenv('MQTT_SUPPRESS_UNCHANGED', 'true').lower() in ('1', 'true', 'yes')  # skip re-publishing identical state
+
+# Characters that are not safe in a topic level
+_TOPIC_UNSAFE = str.maketrans({char: '_' for char in ' /+#&'})
 
-client = None
+# Process-wide MQTT connection, created once by setup_mqtt_client()
+connection = None
 mqtt_app = None
-mqtt_connected = False
-mqtt_connection_error = "Not initialized"
+publisher = None
+ingest_worker = None
+election = None
+instance_id = None  # this process, unlike MQTT_ORIGIN_ID which is shared by all server processes
+
+ROLE_SUBSCRIBER = "subscriber"  # applies inbound device commands
+ROLE_PUBLISHER = "publisher"    # publish-only standby
+role = ROLE_PUBLISHER
+
+# device_id -> (device type, status topics); rebuilt only when the type changes
+_device_topics = {}
+# device_id -> last state published since the last (re)connect
+_published_state = {}
+suppressed_publishes = 0
+# device_id -> highest state version published or seen, see next_state_version()
+_state_versions = {}
+_state_versions_lock = threading.Lock()
+suppressed_echoes = 0   # inbound messages dropped because this server published them
+suppressed_stale = 0    # inbound messages dropped because a newer state version was already seen
 
 def sanitize_topic(topic_part):
     """Ensure topic parts are valid MQTT topic names"""
     if not topic_part:
         return "unknown"
     # Replace spaces and special characters that might cause issues in MQTT topics
-    return str(topic_part).replace(' ', '_').replace('/', '_').replace('+', '_').replace('#', '_').replace('&', '_')
+    return str(topic_part).translate(_TOPIC_UNSAFE)
 
 def get_device_topic(device):
     """Generate a proper MQTT topic for a device based on its ID (follows API route pattern)"""
@@ -36,112 +91,253 @@ def get_device_topic(device):
     # Use format similar to API routes: devices/{id}
     return f"{MQTT_TOPIC_PREFIX}devices/{device_id_str}"
 
-def publish_device_status(device):
-    """Publish device status to MQTT topic"""
-    global client, mqtt_connected
-    
-    # Check if client exists and is connected
-    if not client:
-        print("MQTT client not initialized. Cannot publish message.")
+def _send_message(topic, payload, qos, retain):
+    """Publish one message on the shared client (runs on the publisher thread)"""
+    if not connection:
+        return False
+    family = topic_family(topic, MQTT_TOPIC_PREFIX)
+    try:
+        result = connection.publish(topic, payload, qos=qos, retain=retain)
+    except Exception as e:
+        mqtt_publish_failures.inc(family)
+        log.error("Error publishing message: %s", e, extra={'topic': topic})
         return False
     
-    if not mqtt_connected or not client.is_connected():
-        print("MQTT client not connected. Attempting to reconnect...")
-        reconnected = try_reconnect()
-        if not reconnected:
-            print("Failed to reconnect to MQTT broker. Message not published.")
+    if result is not None and result.rc == mqtt.MQTT_ERR_SUCCESS:
+        mqtt_published.inc(family)
+        message_log.debug("Published", extra={'topic': topic, 'payload': payload})
+        return True
+    mqtt_publish_failures.inc(family)
+    log.warning("Failed to publish", extra={'topic': topic, 'rc': result.rc if result is not None else 'no client'})
+    return False
+
+def _is_connected():
+    return bool(connection and connection.is_connected())
+
+def device_status_topics(device):
+    """(topic, qos, retain) for each status topic enabled by MQTT_PUBLISH_TOPICS, cached per device"""
+    cached = _device_topics.get(device.id)
+    if cached is not None and cached[0] == device.type:
+        return cached[1]
+    
+    topics = []
+    if 'devices' in MQTT_PUBLISH_TOPICS:
+        # Use retain flag to ensure status persists on broker (devices/{id}/status matches the API pattern)
+        topics.append((f"{get_device_topic(device)}/status", 1, True))
+    if 'legacy' in MQTT_PUBLISH_TOPICS:
+        # Legacy type-based topic for backward compatibility
+        topics.append((f"{MQTT_TOPIC_PREFIX}{sanitize_topic(device.type or 'unknown')}/{device.id}/status", 1, True))
+    if 'all' in MQTT_PUBLISH_TOPICS:
+        # Common status topic for all devices
+        topics.append((f"{MQTT_TOPIC_PREFIX}all/updates", 0, False))
+    topics = tuple(topics)
+    _device_topics[device.id] = (device.type, topics)
+    return topics
+
+def next_state_version(device_id):
+    """Next state version for a device: increasing per device, also across restarts.
+
+    Versions are microsecond timestamps, bumped past the last version this
+    process published or received so they never go backwards.
+    """
+    with _state_versions_lock:
+        version = max(time.time_ns() // 1000, _state_versions.get(device_id, 0) + 1)
+        _state_versions[device_id] = version
+        return version
+
+def _is_echo_or_stale(device_id, payload):
+    """True if an inbound message is our own publish or older than a state already seen"""
+    global suppressed_echoes, suppressed_stale
+    origin = payload.get('origin')
+    if origin == MQTT_ORIGIN_ID:
+        suppressed_echoes += 1
+        return True
+    # Only server-published states carry a meaningful version; a device or app
+    # may send its own "version" field, which must not be compared with ours
+    if origin is not None and not _accept_state_version(device_id, payload.get('version')):
+        suppressed_stale += 1
+        return True
+    return False
+
+def _accept_state_version(device_id, version):
+    """Record an inbound state version; False if a newer one was already published or seen"""
+    if not isinstance(version, int) or isinstance(version, bool):
+        return True
+    with _state_versions_lock:
+        if version <= _state_versions.get(device_id, 0):
             return False
+        _state_versions[device_id] = version
+        return True
 
-    try:
-        # Get properly formatted topic for this device (follows API pattern)
-        base_topic = get_device_topic(device)
-        status_topic = f"{base_topic}/status"   # devices/{id}/status - matches API pattern
-        
-        payload = json.dumps({
-            'id': device.id,
-            'name': device.name,
-            'type': device.type,
-            'status': device.status,
-            'value': device.value,
-            'room_id': device.room_id,
-            'timestamp': time.time()
-        })
-        
-        # Use retain flag to ensure status persists on broker
-        result = client.publish(status_topic, payload, qos=1, retain=True)
-        
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            print(f"Successfully published to {status_topic}: {payload}")
-            
-            # Also publish to legacy topics for backward compatibility
-            legacy_topic = f"{MQTT_TOPIC_PREFIX}{sanitize_topic(device.type or 'unknown')}/{device.id}/status"
-            client.publish(legacy_topic, payload, qos=1, retain=True)
-            
-            # Also publish to a common status topic for all devices
-            common_topic = f"{MQTT_TOPIC_PREFIX}all/updates"
-            client.publish(common_topic, payload, qos=0, retain=False)
-            
-            return True
+def _device_messages(device):
+    """Encode a device's status once and return the (topic, payload, qos, retain) messages for it"""
+    # Encoded once and shared by every status topic and the streaming clients
+    timestamp = time.time()
+    meta = {'origin': MQTT_ORIGIN_ID, 'version': next_state_version(device.id), 'instance': instance_id}
+    payload = device_payload(device, timestamp, **meta)
+    
+    # The device cache answers without a query; the database is only asked when
+    # local streaming clients need the owner. Other processes fall back to their own cache
+    owner_id = device_cache.owner_of_room(device.room_id)
+    if owner_id is None and event_hub.has_subscribers():
+        owner_id = event_hub.owner_of_room(device.room_id)
+    
+    messages = []
+    stream_payload = payload
+    for topic, qos, retain in device_status_topics(device):
+        if topic == f"{MQTT_TOPIC_PREFIX}all/updates":
+            # Carries the owner so other server processes can route it to streams without a query
+            stream_payload = device_payload(device, timestamp, owner_id=owner_id, **meta)
+            messages.append((topic, stream_payload, qos, retain))
         else:
-            print(f"Failed to publish to {status_topic}. Error code: {result.rc}")
-            return False
-    except Exception as e:
-        print(f"Error publishing message: {e}")
-        return False
+            messages.append((topic, payload, qos, retain))
+    
+    # Streaming clients of the device's owner get the same payload as all/updates
+    event_hub.publish_device_update(device.room_id, stream_payload, owner_id)
+    
+    return messages
 
-def on_connect(client, userdata, flags, rc):
-    global mqtt_connected, mqtt_connection_error
-    connect_results = {
-        0: "Connection successful",
-        1: "Connection refused - incorrect protocol version",
-        2: "Connection refused - invalid client identifier",
-        3: "Connection refused - server unavailable",
-        4: "Connection refused - bad username or password",
-        5: "Connection refused - not authorized",
-        6: "Connection refused - not yet available",
-        7: "Connection refused - server unavailable"
-    }
+def forget_device(device_id):
+    """Drop cached topics and published state of a deleted device and tell the other server processes"""
+    _device_topics.pop(device_id, None)
+    _published_state.pop(device_id, None)
+    # The state version is kept: a reused id must not accept the old device's retained messages
+    
+    if publisher and 'all' in MQTT_PUBLISH_TOPICS:
+        payload = encode({'id': device_id, 'deleted': True, 'origin': MQTT_ORIGIN_ID,
+                          'version': next_state_version(device_id), 'instance': instance_id})
+        publisher.submit(device_id, [(f"{MQTT_TOPIC_PREFIX}all/updates", payload, 0, False)])
+
+def publish_device_status(device):
+    """Queue device status for publishing; returns PUBLISH_QUEUED, PUBLISH_DEFERRED, PUBLISH_DROPPED or PUBLISH_UNCHANGED"""
+    return publish_devices_status([device])
+
+def publish_devices_status(devices):
+    """Queue the status of several devices as one burst; returns a single PUBLISH_* result"""
+    global suppressed_publishes
+    updates = []
+    for device in devices:
+        state = (device.name, device.type, device.status, device.value, device.room_id)
+        if MQTT_SUPPRESS_UNCHANGED:
+            if _published_state.get(device.id) == state:
+                suppressed_publishes += 1
+                continue
+            _published_state[device.id] = state
+        updates.append((device.id, _device_messages(device)))
+    
+    if not updates:
+        return PUBLISH_UNCHANGED
+    
+    if not publisher:
+        log.warning("MQTT client not initialized. Cannot publish message.")
+        _forget_published(updates)
+        return PUBLISH_DROPPED
+    
+    result = publisher.submit_many(updates)
+    if result == PUBLISH_DROPPED:
+        message_log.warning("MQTT outbound queue full, update dropped",
+                            extra={'device_ids': [device_id for device_id, _ in updates]})
+        _forget_published(updates)
+    return result
+
+def _forget_published(updates):
+    # Updates that never reached the publisher must not suppress the next attempt
+    for device_id, messages in updates:
+        _published_state.pop(device_id, None)
+
+def _on_ingest_applied(device, status, value, received_at):
+    record_history(device.id, status, value, received_at)
+
+def _subscribe_device_topics(client):
+    # Subscribe only to legacy formats for backward compatibility
+    for device_type in ["light", "thermostat", "plug", "fan", "sensor", "unknown"]:
+        client.subscribe(f"{MQTT_TOPIC_PREFIX}{device_type}/+/control")
+        client.subscribe(f"{MQTT_TOPIC_PREFIX}{device_type}/+/status")
     
+    # Also subscribe to simple control topics
+    client.subscribe(f"{MQTT_TOPIC_PREFIX}control/#")
+    
+    log.info("Subscribed to legacy topics for backward compatibility")
+
+def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        mqtt_connected = True
-        mqtt_connection_error = None
-        print(f"Successfully connected to MQTT broker ({MQTT_BROKER_URL}:{MQTT_BROKER_PORT})")
+        log.info("Successfully connected to MQTT broker (%s:%s)", MQTT_BROKER_URL, MQTT_BROKER_PORT)
+        
+        # Only the elected process applies device commands, so each is applied once
+        if role == ROLE_SUBSCRIBER:
+            _subscribe_device_topics(client)
+        else:
+            log.info("Publish-only process: not subscribing to device topics")
         
-        # Subscribe only to legacy formats for backward compatibility
-        for device_type in ["light", "thermostat", "plug", "fan", "sensor", "unknown"]:
-            client.subscribe(f"{MQTT_TOPIC_PREFIX}{device_type}/+/control")
-            client.subscribe(f"{MQTT_TOPIC_PREFIX}{device_type}/+/status")
+        # Every process follows the updates published by the others to keep its cache current
+        client.subscribe(f"{MQTT_TOPIC_PREFIX}all/updates")
+        
+        # Publish that we're online (the will message flips this back to offline)
+        client.publish(
+            f"{MQTT_TOPIC_PREFIX}system/clients/{connection.client_id}", 
+            payload=json.dumps({"status": "online"}), 
+            qos=1,
+            retain=True
+        )
         
-        # Also subscribe to simple control topics
-        client.subscribe(f"{MQTT_TOPIC_PREFIX}control/#")
+        # The broker may have lost non-retained state while we were away: publish everything again
+        _published_state.clear()
         
-        print(f"Subscribed to legacy topics for backward compatibility")
+        # Replay device updates that were deferred while the broker was unreachable
+        if publisher:
+            publisher.notify_connected()
     else:
-        mqtt_connected = False
-        result_message = connect_results.get(rc, f"Unknown error (code {rc})")
-        mqtt_connection_error = result_message
-        print(f"Failed to connect to MQTT broker: {result_message}")
-        print(f"Current settings - Broker: {MQTT_BROKER_URL}, Port: {MQTT_BROKER_PORT}")
-        print(f"Username: {MQTT_USERNAME}, Client ID: {MQTT_CLIENT_ID}")
+        result_message = CONNECT_RESULTS.get(rc, f"Unknown error (code {rc})")
+        log.error("Failed to connect to MQTT broker: %s", result_message,
+                  extra={'broker': f"{MQTT_BROKER_URL}:{MQTT_BROKER_PORT}", 'username': MQTT_USERNAME,
+                         'client_id': MQTT_CLIENT_ID})
 
 def on_disconnect(client, userdata, rc):
-    global mqtt_connected, mqtt_connection_error
-    mqtt_connected = False
-    
     if rc == 0:
-        mqtt_connection_error = "Disconnected normally"
-        print("Disconnected from MQTT broker normally")
+        log.info("Disconnected from MQTT broker normally")
     else:
-        mqtt_connection_error = f"Unexpected disconnect (code {rc})"
-        print(f"Disconnected from MQTT broker with result code: {rc}")
+        log.warning("Unexpected disconnection from MQTT broker, will reconnect after a delay", extra={'rc': rc})
         if rc == 7:
-            print("Error 7: This is commonly an authentication or permission issue")
-        print("Unexpected disconnection. Will attempt to reconnect after delay...")
+            log.warning("Error 7: This is commonly an authentication or permission issue")
+
+def _on_sync_message(raw):
+    """Apply a device update published by another process of this server to the local cache"""
+    try:
+        payload = decode(raw)
+    except ValueError:
+        return
+    if (not isinstance(payload, dict) or payload.get('origin') != MQTT_ORIGIN_ID
+            or payload.get('instance') == instance_id or not isinstance(payload.get('id'), int)):
+        return
+    if not _accept_state_version(payload['id'], payload.get('version')):
+        return
+    
+    # The broker now holds the other process's state, not the one we last published:
+    # our next publish of this device must not be suppressed as unchanged
+    _published_state.pop(payload['id'], None)
+    
+    if payload.get('deleted'):
+        device_cache.remove_device(payload['id'])
+        return
+    snapshot = {field: payload.get(field) for field in DEVICE_FIELDS}
+    device_cache.upsert_device(snapshot)
+    
+    # This runs on paho's network thread, outside any app context: never look the owner up in the database
+    owner_id = payload.get('owner_id')
+    if not isinstance(owner_id, int):
+        owner_id = device_cache.owner_of_room(snapshot['room_id'])
+    if owner_id is not None:
+        event_hub.publish_device_update(snapshot['room_id'], raw, owner_id)
 
 def on_message(client, userdata, msg):
     """Handle incoming MQTT messages for device control"""
+    mqtt_received.inc(topic_family(msg.topic, MQTT_TOPIC_PREFIX))
     try:
-        print(f"Received message on topic: {msg.topic}")
+        if msg.topic == f"{MQTT_TOPIC_PREFIX}all/updates":
+            _on_sync_message(msg.payload)
+            return
+        
+        message_log.debug("Received", extra={'topic': msg.topic, 'payload': msg.payload})
         
         # Extract device ID from topic
         topic_parts = msg.topic.split('/')
@@ -160,7 +356,7 @@ def on_message(client, userdata, msg):
                     device_id = int(topic_parts[2])
                     action = topic_parts[3]
                 except ValueError:
-                    print(f"Invalid device ID in topic: {msg.topic}")
+                    message_log.warning("Invalid device ID in topic", extra={'topic': msg.topic})
                     return
             
             # Check legacy format (type/{id}/action)
@@ -169,7 +365,7 @@ def on_message(client, userdata, msg):
                     device_id = int(topic_parts[2])
                     action = topic_parts[3]
                 except ValueError:
-                    print(f"Invalid device ID in topic: {msg.topic}")
+                    message_log.warning("Invalid device ID in topic", extra={'topic': msg.topic})
                     return
         
         # Check simple format (control/{id})
@@ -178,17 +374,20 @@ def on_message(client, userdata, msg):
                 device_id = int(topic_parts[2])
                 action = "control"
             except ValueError:
-                print(f"Invalid device ID in topic: {msg.topic}")
+                message_log.warning("Invalid device ID in topic", extra={'topic': msg.topic})
                 return
         
         if not device_id:
-            print(f"Could not extract device ID from topic: {msg.topic}")
+            message_log.warning("Could not extract device ID from topic", extra={'topic': msg.topic})
             return
             
         # Parse the message payload
         try:
-            payload = json.loads(msg.payload.decode())
-        except json.JSONDecodeError:
+            payload = decode(msg.payload)
+            if not isinstance(payload, dict):
+                # Bare JSON scalars like 1 or true are simple commands too
+                raise ValueError("Not a JSON object")
+        except ValueError:
             # Handle simple string commands from mosquitto_pub
             payload_str = msg.payload.decode().strip().lower()
             payload = {}
@@ -206,209 +405,147 @@ def on_message(client, userdata, msg):
                     value = float(payload_str)
                     payload["value"] = value
                 except ValueError:
-                    print(f"Unrecognized command: {payload_str}")
+                    message_log.warning("Unrecognized command", extra={'topic': msg.topic, 'payload': payload_str})
                     return
         
-        # Update device in database
-        with mqtt_app.app_context():
-            device = Device.query.get(device_id)
-            if device:
-                # Handle special actions
-                if action == "toggle" or "toggle" in payload:
-                    device.status = not device.status
-                    print(f"Toggling device {device_id} to {device.status}")
-                else:
-                    # Normal control
-                    if 'status' in payload:
-                        device.status = payload['status']
-                    if 'value' in payload:
-                        device.value = payload['value']
-                
-                db.session.commit()
-                
-                # Publish the updated status
-                publish_device_status(device)
-                print(f"Updated device {device_id}: {payload}")
-            else:
-                print(f"Device {device_id} not found")
-    except Exception as e:
-        print(f"Error processing MQTT message: {e}")
-
-def try_reconnect():
-    """Try to reconnect to the MQTT broker"""
-    global client, mqtt_connected, mqtt_connection_error
-    
-    if not client:
-        mqtt_connection_error = "MQTT client not initialized"
-        return False
-    
-    try:
-        print(f"Attempting to reconnect to MQTT broker {MQTT_BROKER_URL}...")
-        # Add a delay before reconnection attempt to avoid immediate retries
-        time.sleep(MQTT_RECONNECT_DELAY)
+        # Our own retained/echoed status messages and out-of-date states never reach the database
+        if _is_echo_or_stale(device_id, payload):
+            return
         
-        # Create a new client if the old one is in a bad state
-        if not client.is_connected():
-            # Close the old connection first
-            try:
-                client.loop_stop()
-                client.disconnect()
-            except:
-                pass
-                
-            # Create and configure a new client instance
-            unique_client_id = f"{MQTT_CLIENT_ID or 'smart_home_app'}_{int(time.time())}"
-            print(f"Creating new MQTT client with ID: {unique_client_id}")
-            
-            client = mqtt.Client(client_id=unique_client_id, clean_session=True, protocol=mqtt.MQTTv311)
-            
-            if MQTT_USERNAME and MQTT_PASSWORD:
-                client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-                
-            client.on_connect = on_connect
-            client.on_disconnect = on_disconnect
-            client.on_message = on_message
-            
-            # Set will message
-            client.will_set(
-                f"{MQTT_TOPIC_PREFIX}system/clients/{unique_client_id}", 
-                payload=json.dumps({"status": "offline"}), 
-                qos=1,
-                retain=True
-            )
-            
-            # Connect and start loop
-            client.connect(MQTT_BROKER_URL, MQTT_BROKER_PORT, keepalive=60)
-            client.loop_start()
-        else:
-            # Try simple reconnect if client exists and seems healthy
-            client.reconnect()
-            
-        # Wait to check connection status
-        wait_count = 0
-        max_wait = 5  # Maximum seconds to wait for connection
-        while wait_count < max_wait and not mqtt_connected:
-            time.sleep(1)
-            wait_count += 1
-            
-        if mqtt_connected:
-            print(f"Successfully reconnected to MQTT broker after {wait_count} seconds")
-            return True
-        else:
-            mqtt_connection_error = "Failed to reconnect within timeout"
-            print(f"Failed to reconnect to MQTT broker after {max_wait} seconds")
-            return False
-    except Exception as e:
-        mqtt_connection_error = f"Reconnection failed: {str(e)}"
-        print(f"Failed to reconnect to MQTT broker: {e}")
-        return False
+        # Hand off to the ingest worker; database work never runs on the network thread
+        if not ingest_worker or not ingest_worker.submit(device_id, action, payload):
+            message_log.warning("MQTT ingest queue unavailable or full, message dropped", extra={'device_id': device_id})
+    except Exception:
+        log.exception("Error processing MQTT message", extra={'topic': msg.topic})
 
 def setup_mqtt_client(app):
-    """Initialize and configure MQTT client"""
-    global client, mqtt_app, mqtt_connected, mqtt_connection_error
+    """Start the process-wide MQTT connection and its worker threads (idempotent)"""
+    global connection, mqtt_app, publisher, ingest_worker, election, instance_id, role
     mqtt_app = app
     
-    if client:
-        # If client already exists, disconnect it first
-        try:
-            client.loop_stop()
-            client.disconnect()
-        except Exception as e:
-            print(f"Error disconnecting existing client: {e}")
+    # Set here rather than at import so forked worker processes each get their own
+    if not instance_id:
+        instance_id = uuid.uuid4().hex[:12]
     
-    # Create new client instance with a uniquely identifiable client_id
-    unique_client_id = f"{MQTT_CLIENT_ID or 'smart_home_app'}_{int(time.time())}"
-    print(f"Creating MQTT client with ID: {unique_client_id}")
+    # One subscriber per host: the other processes publish only until it goes away
+    if not election:
+        election = FileLockElection(MQTT_SUBSCRIBER_LOCK, MQTT_ELECTION_INTERVAL, on_elected=_promote_to_subscriber)
+        role = ROLE_SUBSCRIBER if election.start() else ROLE_PUBLISHER
+        log.info("MQTT role: %s", role, extra={'pid': os.getpid()})
     
-    # Set 3.1.1 protocol version explicitly
-    client = mqtt.Client(client_id=unique_client_id, clean_session=True, protocol=mqtt.MQTTv311)
+    # Inbound messages are applied to the database in batches on a worker thread
+    if not ingest_worker:
+        ingest_worker = IngestWorker(
+            app,
+            on_applied=_on_ingest_applied,
+            on_committed=publish_device_status,
+            batch_size=MQTT_INGEST_BATCH_SIZE,
+            batch_wait=MQTT_INGEST_BATCH_WAIT,
+            max_queue=MQTT_INGEST_QUEUE_SIZE
+        )
+        ingest_worker.start()
+    else:
+        ingest_worker.app = app
     
-    # Only set username/password if they are provided
-    if MQTT_USERNAME and MQTT_PASSWORD:
-        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-        
-    client.on_connect = on_connect
-    client.on_disconnect = on_disconnect
-    client.on_message = on_message
+    # Publishes go through a dedicated thread so request threads never wait on the broker
+    if not publisher:
+        publisher = OutboundPublisher(
+            _send_message,
+            _is_connected,
+            max_queue=MQTT_OUTBOUND_QUEUE_SIZE,
+            retry_interval=MQTT_RECONNECT_DELAY
+        )
+        publisher.start()
     
-    # Set a reasonable keepalive interval (in seconds)
-    keepalive = 60
+    if connection:
+        return connection
     
-    # Set up will message (last testament) to show this client disconnected
-    client.will_set(
-        f"{MQTT_TOPIC_PREFIX}system/clients/{unique_client_id}", 
-        payload=json.dumps({"status": "offline"}), 
-        qos=1,
-        retain=True
-    )
+    # One client per process, identified uniquely so several servers can share a broker
+    unique_client_id = f"{MQTT_CLIENT_ID or 'smart_home_app'}_{os.getpid()}_{int(time.time())}"
+    log.info("Connecting to MQTT broker %s:%s", MQTT_BROKER_URL, MQTT_BROKER_PORT, extra={'client_id': unique_client_id})
     
-    # Connect to the MQTT broker
-    try:
-        print(f"Connecting to MQTT broker {MQTT_BROKER_URL}:{MQTT_BROKER_PORT}...")
-        mqtt_connection_error = "Connection in progress"
-        # Use connect instead of connect_async for initial connection to get immediate feedback
-        client.connect(MQTT_BROKER_URL, MQTT_BROKER_PORT, keepalive=keepalive)
-        client.loop_start()
-        
-        # Wait briefly to check connection status
-        time.sleep(2)
-        
-        if not client.is_connected():
-            mqtt_connection_error = "Failed to connect within initial timeout"
-            print("MQTT broker connection didn't complete in expected time")
-        
-        # Publish that we're online
-        client.publish(
-            f"{MQTT_TOPIC_PREFIX}system/clients/{unique_client_id}", 
-            payload=json.dumps({"status": "online"}), 
-            qos=1,
-            retain=True
-        )
-        
-        # Configure automatic reconnection
-        client.reconnect_delay_set(min_delay=1, max_delay=30)
-        
-    except Exception as e:
-        mqtt_connected = False
-        mqtt_connection_error = f"Connection error: {str(e)}"
-        print(f"Failed to connect to MQTT broker: {e}")
-        print("Check your network connection and MQTT broker settings")
+    connection = MqttConnectionManager(
+        MQTT_BROKER_URL,
+        MQTT_BROKER_PORT,
+        unique_client_id,
+        username=MQTT_USERNAME,
+        password=MQTT_PASSWORD,
+        keepalive=MQTT_KEEPALIVE,
+        min_backoff=MQTT_RECONNECT_MIN_DELAY,
+        max_backoff=MQTT_RECONNECT_MAX_DELAY,
+        # Will message (last testament) shows this client disconnected
+        will_topic=f"{MQTT_TOPIC_PREFIX}system/clients/{unique_client_id}",
+        will_payload=json.dumps({"status": "offline"}),
+        on_connect=on_connect,
+        on_disconnect=on_disconnect,
+        on_message=on_message
+    )
+    connection.start()
+    return connection
+
+def _promote_to_subscriber():
+    """Called on the election thread when the previous subscriber process exited"""
+    global role
+    role = ROLE_SUBSCRIBER
+    log.info("MQTT role: %s, taking over device topics", role, extra={'pid': os.getpid()})
+    client = connection.client if connection else None
+    if client and connection.is_connected():
+        _subscribe_device_topics(client)
+    # Otherwise on_connect subscribes once the connection is up
 
 def get_mqtt_status():
     """Return current MQTT connection status information"""
-    global mqtt_connected, client, mqtt_connection_error, MQTT_BROKER_URL, MQTT_BROKER_PORT
+    connected = _is_connected()
     
     status = {
-        "connected": mqtt_connected,
+        "connected": connected,
+        "state": connection.state if connection else "closed",
         "broker_url": MQTT_BROKER_URL,
         "broker_port": MQTT_BROKER_PORT,
-        "error_message": mqtt_connection_error if not mqtt_connected else None,
-        "client_id": MQTT_CLIENT_ID
+        "error_message": (connection.last_error if connection else "Not initialized") if not connected else None,
+        "client_id": connection.client_id if connection else MQTT_CLIENT_ID,
+        "reconnects": connection.reconnects if connection else 0,
+        "outbound_queue_depth": publisher.queue_depth() if publisher else 0,
+        "outbound_pending": publisher.pending_count() if publisher else 0,
+        "ingest_queue_depth": ingest_worker.queue_depth() if ingest_worker else 0,
+        "role": role,
+        "instance_id": instance_id,
+        "suppressed_publishes": suppressed_publishes,
+        "origin_id": MQTT_ORIGIN_ID,
+        "suppressed_echoes": suppressed_echoes,
+        "suppressed_stale": suppressed_stale
     }
     
     return status
 
 def disconnect_mqtt():
-    """Disconnect and stop MQTT client"""
-    global client, mqtt_connected
+    """Drain the MQTT workers and close the connection; runs once at process exit"""
+    global connection
     
-    if client:
+    if ingest_worker:
+        ingest_worker.stop()
+    if publisher:
+        publisher.stop()
+    
+    if connection:
         try:
             # Only publish if we're actually connected
-            if mqtt_connected and client.is_connected():
+            if connection.is_connected():
                 # Publish offline status before disconnecting
-                client.publish(
-                    f"smart-home/system/clients/{MQTT_CLIENT_ID}", 
+                connection.publish(
+                    f"{MQTT_TOPIC_PREFIX}system/clients/{connection.client_id}", 
                     payload=json.dumps({"status": "offline"}), 
                     qos=1,
                     retain=True
                 )
-                
-            client.loop_stop()
-            client.disconnect()
-            mqtt_connected = False
-            print("MQTT client disconnected successfully")
+            connection.close()
+            log.info("MQTT client disconnected successfully")
         except Exception as e:
-            print(f"Error disconnecting MQTT client: {e}")
-            # Set connected to false anyway since we're shutting down
-            mqtt_connected = False
+            log.error("Error disconnecting MQTT client: %s", e)
+        connection = None
+    
+    # Let a standby process take over the device topics
+    if election:
+        election.stop()
+
+atexit.register(disconnect_mqtt)
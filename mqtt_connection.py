@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+import paho.mqtt.client as mqtt
+
+log = logging.getLogger(__name__)
+
+# Connection states reported by MqttConnectionManager.state
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_BACKOFF = "backoff"
+STATE_CLOSED = "closed"
+
+CONNECT_RESULTS = {
+    0: "Connection successful",
+    1: "Connection refused - incorrect protocol version",
+    2: "Connection refused - invalid client identifier",
+    3: "Connection refused - server unavailable",
+    4: "Connection refused - bad username or password",
+    5: "Connection refused - not authorized",
+    6: "Connection refused - not yet available",
+    7: "Connection refused - server unavailable"
+}
+
+class MqttConnectionManager:
+    """Owns the single MQTT client of this process for its whole lifetime.
+
+    The client connects asynchronously and paho's network thread retries with
+    exponential backoff (``min_backoff``..``max_backoff`` seconds) whenever the
+    broker is unreachable, so no caller ever waits for a connection. The
+    current client is only read or replaced under a lock; callbacks coming
+    from a client that has since been swapped out are ignored.
+    """
+
+    def __init__(self, host, port, client_id, username='', password='', keepalive=60,
+                 min_backoff=1, max_backoff=30, will_topic=None, will_payload=None,
+                 on_connect=None, on_disconnect=None, on_message=None, client_factory=None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.will_topic = will_topic
+        self.will_payload = will_payload
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.on_message = on_message
+        self._client_factory = client_factory or self._default_client_factory
+        self._lock = threading.RLock()
+        self._client = None
+        self._state = STATE_CLOSED
+        self._state_since = time.time()
+        self.last_error = "Not initialized"
+        self.connects = 0
+        self.reconnects = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def client(self):
+        with self._lock:
+            return self._client
+
+    def is_connected(self):
+        current_client = self.client
+        return bool(self._state == STATE_CONNECTED and current_client and current_client.is_connected())
+
+    def status(self):
+        return {
+            "state": self._state,
+            "state_since": self._state_since,
+            "connects": self.connects,
+            "reconnects": self.reconnects
+        }
+
+    def start(self):
+        """Create the client and start connecting in the background"""
+        with self._lock:
+            if self._client:
+                return
+            self._client = self._connect_new_client()
+
+    def reconnect(self):
+        """Swap in a fresh client, e.g. when the current one is wedged"""
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return
+            old_client = self._client
+            self._client = self._connect_new_client()
+        self._stop_client(old_client)
+
+    def close(self):
+        """Disconnect for good; only called at process shutdown"""
+        with self._lock:
+            old_client = self._client
+            self._client = None
+            self._set_state(STATE_CLOSED)
+        self._stop_client(old_client)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Publish on the current client; returns paho's MQTTMessageInfo or None without a client"""
+        current_client = self.client
+        if not current_client:
+            return None
+        return current_client.publish(topic, payload, qos=qos, retain=retain)
+
+    def _default_client_factory(self):
+        return mqtt.Client(client_id=self.client_id, clean_session=True, protocol=mqtt.MQTTv311)
+
+    def _connect_new_client(self):
+        new_client = self._client_factory()
+        if self.username and self.password:
+            new_client.username_pw_set(self.username, self.password)
+        new_client.on_connect = self._handle_connect
+        new_client.on_disconnect = self._handle_disconnect
+        new_client.on_connect_fail = self._handle_connect_fail
+        new_client.on_pre_connect = self._handle_pre_connect
+        new_client.on_message = self.on_message
+        if self.will_topic:
+            new_client.will_set(self.will_topic, payload=self.will_payload, qos=1, retain=True)
+        new_client.reconnect_delay_set(min_delay=self.min_backoff, max_delay=self.max_backoff)
+
+        self._set_state(STATE_CONNECTING)
+        # connect_async only records the target; the network thread started by
+        # loop_start() performs the connection and keeps retrying with backoff
+        new_client.connect_async(self.host, self.port, keepalive=self.keepalive)
+        new_client.loop_start()
+        return new_client
+
+    def _stop_client(self, old_client):
+        if not old_client:
+            return
+        try:
+            old_client.disconnect()
+            old_client.loop_stop()
+        except Exception as e:
+            log.error("Error stopping MQTT client: %s", e)
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self._state_since = time.time()
+
+    def _is_current(self, source_client):
+        with self._lock:
+            return source_client is self._client and self._state != STATE_CLOSED
+
+    def _handle_pre_connect(self, source_client, userdata):
+        if self._is_current(source_client):
+            self._set_state(STATE_CONNECTING)
+
+    def _handle_connect(self, source_client, userdata, flags, rc):
+        if not self._is_current(source_client):
+            return
+        if rc == 0:
+            self._set_state(STATE_CONNECTED)
+            self.last_error = None
+            if self.connects:
+                self.reconnects += 1
+            self.connects += 1
+        else:
+            self._set_state(STATE_BACKOFF)
+            self.last_error = CONNECT_RESULTS.get(rc, f"Unknown error (code {rc})")
+        if self.on_connect:
+            self.on_connect(source_client, userdata, flags, rc)
+
+    def _handle_connect_fail(self, source_client, userdata):
+        if not self._is_current(source_client):
+            return
+        self._set_state(STATE_BACKOFF)
+        self.last_error = f"Could not reach broker {self.host}:{self.port}"
+
+    def _handle_disconnect(self, source_client, userdata, rc):
+        if not self._is_current(source_client):
+            return
+        self._set_state(STATE_BACKOFF)
+        self.last_error = "Disconnected normally" if rc == 0 else f"Unexpected disconnect (code {rc})"
+        if self.on_disconnect:
+            self.on_disconnect(source_client, userdata, rc)
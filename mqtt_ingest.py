@@ -0,0 +1,200 @@
+import logging
+import math
+import queue
+import threading
+import time
+from datetime import datetime
+from models import db, Device
+from storage import commit
+
+log = logging.getLogger(__name__)
+message_log = logging.getLogger(__name__ + '.messages')
+
+_STOP = object()
+
+def apply_message(device, action, payload):
+    """Apply one parsed MQTT command to a device.
+
+    Raises ValueError, before changing the device, if ``status`` is not a
+    boolean or 0/1, or ``value`` is not a number.
+    """
+    # Handle special actions
+    if action == "toggle" or "toggle" in payload:
+        device.status = not device.status
+        return
+    
+    # Normal control; firmware sends 1/0 as well as true/false
+    if 'status' in payload:
+        status = payload['status']
+        if isinstance(status, int) and status in (0, 1):
+            status = bool(status)
+        else:
+            raise ValueError(f"status must be true, false, 1 or 0, got {payload['status']!r}")
+    if 'value' in payload:
+        try:
+            value = float(payload['value'])
+        except (TypeError, ValueError):
+            raise ValueError(f"value must be a number, got {payload['value']!r}") from None
+        if not math.isfinite(value):
+            raise ValueError(f"value must be finite, got {payload['value']!r}")
+    
+    if 'status' in payload:
+        device.status = status
+    if 'value' in payload:
+        device.value = value
+
+class IngestWorker:
+    """Moves inbound MQTT commands off paho's network thread and applies them in micro-batches.
+
+    on_message only parses the topic/payload and calls submit(). The worker
+    collects up to ``batch_size`` messages (waiting at most ``batch_wait``
+    seconds after the first one), loads every affected device with one query,
+    applies the messages in arrival order and commits once per batch.
+    Invalid commands are skipped; if the batch commit still fails, the
+    messages are retried one per transaction so the valid ones are kept.
+    ``on_applied(device, status, value, received_at)`` is called for every applied message and
+    ``on_committed(device)`` once per updated device after the commit.
+    """
+
+    def __init__(self, app, on_applied=None, on_committed=None, batch_size=500, batch_wait=0.05, max_queue=10000):
+        self.app = app
+        self.on_applied = on_applied
+        self.on_committed = on_committed
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+        self.not_found = 0
+        self.invalid = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="mqtt-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def submit(self, device_id, action, payload):
+        """Hand a parsed message to the worker; never blocks the network thread"""
+        try:
+            self._queue.put_nowait((device_id, action, payload, datetime.utcnow()))
+            self.received += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "received": self.received,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "not_found": self.not_found,
+            "invalid": self.invalid,
+            "failed": self.failed,
+            "batches": self.batches
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        with self.app.app_context():
+            # Callbacks read the committed devices; don't reload each one after commit
+            db.session().expire_on_commit = False
+            try:
+                try:
+                    results = [self._apply(batch)]
+                except Exception as e:
+                    db.session.rollback()
+                    log.warning("MQTT batch commit failed, retrying messages one by one: %s", e,
+                                extra={'batch_size': len(batch)})
+                    results = []
+                    for item in batch:
+                        try:
+                            results.append(self._apply([item]))
+                        except Exception as e:
+                            db.session.rollback()
+                            self.failed += 1
+                            message_log.warning("Could not apply MQTT command: %s", e, extra={'device_id': item[0]})
+                self.batches += 1
+
+                for applied, updated, not_found, invalid in results:
+                    self.applied += len(applied)
+                    self.not_found += not_found
+                    self.invalid += invalid
+                    if self.on_applied:
+                        for device, status, value, received_at in applied:
+                            self.on_applied(device, status, value, received_at)
+                    if self.on_committed:
+                        for device in updated.values():
+                            self.on_committed(device)
+            except Exception:
+                db.session.rollback()
+                log.exception("Error processing batch of MQTT messages", extra={'batch_size': len(batch)})
+            finally:
+                db.session.remove()
+
+    def _apply(self, batch):
+        """Apply and commit messages in one transaction.
+
+        Returns (applied, updated devices by id, not found count, invalid count).
+        """
+        device_ids = {device_id for device_id, _, _, _ in batch}
+        devices = {device.id: device for device in Device.query.filter(Device.id.in_(device_ids)).all()}
+
+        applied = []
+        updated = {}
+        not_found = invalid = 0
+        for device_id, action, payload, received_at in batch:
+            device = devices.get(device_id)
+            if not device:
+                not_found += 1
+                message_log.warning("Device not found", extra={'device_id': device_id})
+                continue
+            try:
+                apply_message(device, action, payload)
+            except ValueError as e:
+                invalid += 1
+                message_log.warning("Invalid MQTT command: %s", e, extra={'device_id': device_id})
+                continue
+            applied.append((device, device.status, device.value, received_at))
+            updated[device_id] = device
+
+        commit()
+        return applied, updated, not_found, invalid
@@ -0,0 +1,128 @@
+import queue
+import threading
+from collections import OrderedDict
+
+# Results returned to callers of OutboundPublisher.submit()
+PUBLISH_QUEUED = "queued"      # broker connected, handed to the publisher thread
+PUBLISH_DEFERRED = "deferred"  # broker offline, kept for replay on reconnect
+PUBLISH_DROPPED = "dropped"    # outbound queue full
+PUBLISH_UNCHANGED = "unchanged"  # same state already published since the last (re)connect
+
+# Results meaning the broker has (or will get) the device's current state
+PUBLISH_SYNCED = (PUBLISH_QUEUED, PUBLISH_UNCHANGED)
+
+_STOP = object()
+_WAKE = object()
+
+class OutboundPublisher:
+    """Bounded outbound MQTT queue drained by a dedicated publisher thread.
+
+    Callers enqueue the messages for one device update and return immediately.
+    While the broker is unreachable only the latest update per device is kept;
+    those are replayed in the order they were last updated once the connection
+    comes back.
+    """
+
+    def __init__(self, send, is_connected, request_reconnect=None, max_queue=1000, retry_interval=5):
+        # send(topic, payload, qos, retain) -> bool, is_connected() -> bool
+        self._send = send
+        self._is_connected = is_connected
+        self._request_reconnect = request_reconnect
+        self.retry_interval = retry_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = OrderedDict()  # device_id -> messages, only touched by the publisher thread
+        self._pending_count = 0
+        self._thread = None
+        self.published = 0
+        self.dropped = 0
+        self.replayed = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        if self._thread and self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def submit(self, device_id, messages):
+        """Queue the messages for one device update without blocking"""
+        return self.submit_many([(device_id, messages)])
+
+    def submit_many(self, updates):
+        """Queue several (device_id, messages) updates as one item, published back to back"""
+        if not updates:
+            return PUBLISH_QUEUED
+        try:
+            self._queue.put_nowait(updates)
+        except queue.Full:
+            self.dropped += len(updates)
+            return PUBLISH_DROPPED
+        return PUBLISH_QUEUED if self._is_connected() else PUBLISH_DEFERRED
+
+    def notify_connected(self):
+        """Wake the publisher so deferred updates are replayed right away"""
+        try:
+            self._queue.put_nowait(_WAKE)
+        except queue.Full:
+            pass  # the publisher is busy and will replay on its next item
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def pending_count(self):
+        return self._pending_count
+
+    def _defer(self, device_id, messages):
+        # Newer state replaces older state and moves to the back of the replay order
+        self._pending.pop(device_id, None)
+        self._pending[device_id] = messages
+        self._pending_count = len(self._pending)
+
+    def _publish(self, messages):
+        for topic, payload, qos, retain in messages:
+            if not self._send(topic, payload, qos, retain):
+                return False
+        return True
+
+    def _replay(self):
+        while self._pending:
+            device_id, messages = next(iter(self._pending.items()))
+            if not self._is_connected() or not self._publish(messages):
+                return False
+            del self._pending[device_id]
+            self._pending_count = len(self._pending)
+            self.replayed += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.retry_interval)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                return
+            if item is _WAKE:
+                item = None
+
+            connected = self._is_connected()
+            if connected and self._pending:
+                connected = self._replay()
+
+            if item is not None:
+                for device_id, messages in item:
+                    if connected and not self._pending and self._publish(messages):
+                        self.published += 1
+                    else:
+                        self._defer(device_id, messages)
+
+            if self._pending and not self._is_connected() and self._request_reconnect:
+                self._request_reconnect()
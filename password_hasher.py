@@ -0,0 +1,150 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+log = logging.getLogger(__name__)
+
+hasher = None
+
+# Scheduling priority given up by hashing processes, so request threads win the CPU
+HASH_WORKER_NICENESS = 10
+
+class HasherBusy(Exception):
+    """Raised when a password hash could not be started within the queue limits"""
+
+def _init_hash_worker(parent_pid):
+    """Runs in each hashing process: lower its priority and exit with the server process"""
+    if hasattr(os, 'nice'):
+        os.nice(HASH_WORKER_NICENESS)
+
+    # A server worker that is killed (e.g. by gunicorn's timeout) can't shut the pool down
+    def watch_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+
+class PasswordHasher:
+    """Runs password hashing (PBKDF2, hundreds of ms of CPU per call) in a process pool.
+
+    Request threads only wait for the result. The pool's processes run at a
+    lower priority, so a burst of logins uses at most ``workers`` cores and
+    leaves the CPU to every other endpoint first. At most ``max_pending``
+    requests may be hashing or waiting for a free worker at once; more are
+    rejected straight away, and a request that can't get a worker within
+    ``queue_timeout`` seconds gives up, so logins can never tie up all of the
+    server's request threads. With ``workers=0`` hashing runs on the request
+    thread, one at a time.
+    """
+
+    def __init__(self, workers=2, max_pending=4, queue_timeout=1.0):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._admitted = threading.BoundedSemaphore(max_pending)
+        self._running = threading.BoundedSemaphore(max(workers, 1))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._call(check_password_hash, pwhash, password)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+    def stop(self):
+        with self._pool_lock:
+            if self._pool:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _call(self, func, *args):
+        if not self._admitted.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            if not self._running.acquire(timeout=self.queue_timeout):
+                self.rejected += 1
+                raise HasherBusy()
+            try:
+                if self.workers:
+                    result = self._submit(func, *args)
+                else:
+                    result = func(*args)
+                self.completed += 1
+                return result
+            finally:
+                self._running.release()
+        finally:
+            self._admitted.release()
+
+    def _submit(self, func, *args):
+        try:
+            return self._get_pool().submit(func, *args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); start a fresh pool next time
+            log.warning("Password hashing pool broke, restarting it")
+            with self._pool_lock:
+                self._pool = None
+            raise HasherBusy()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Started on first use, in the process that serves requests. Spawned rather
+                # than forked: this process already runs MQTT and writer threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_hash_worker,
+                    initargs=(os.getpid(),)
+                )
+            return self._pool
+
+def setup_password_hasher(app):
+    """Create the process-wide password hasher; its pool starts on the first login or register"""
+    global hasher
+
+    if hasher:
+        hasher.stop()
+
+    hasher = PasswordHasher(
+        workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 4),
+        queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 1.0)
+    )
+    return hasher
+
+def hash_password(password):
+    """Hash a password for storage; raises HasherBusy when the hashing queue is full"""
+    if hasher is None:
+        return generate_password_hash(password)
+    return hasher.hash(password)
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash; raises HasherBusy when the hashing queue is full"""
+    if hasher is None:
+        return check_password_hash(pwhash, password)
+    return hasher.check(pwhash, password)
+
+def shutdown_password_hasher():
+    """Stop the hashing pool; registered to run at process exit"""
+    if hasher:
+        hasher.stop()
+
+atexit.register(shutdown_password_hasher)
@@ -0,0 +1,151 @@
+"""Opt-in profiling of single API requests.
+
+With PROFILING_ENABLED and PROFILING_KEY set, a request to /api/* that
+sends ``X-Profile: <key>`` runs under cProfile and records every SQL
+statement it issues. The report is logged and summarised in X-Profile-*
+response headers; ``X-Profile: <key>:body`` returns the report in place
+of a successful response's body, keeping its status. Without a key
+profiling stays off: reports expose SQL, timings and source paths. The
+key is only accepted in the header, never in the URL, where access logs
+and proxies would record it.
+
+Statements that run PROFILING_N_PLUS_ONE times or more with the same SQL
+in one request are reported as likely N+1 queries, e.g. a lazy
+relationship such as Room.devices or Device.history loaded once per row.
+
+When profiling is off no hook is installed at all.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import pstats
+import threading
+import time
+from collections import defaultdict
+from flask import g, request, Response
+from sqlalchemy import event
+from models import db
+
+log = logging.getLogger(__name__)
+
+# SQL of the request being profiled on this thread; unset on every other thread
+_trace = threading.local()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(_trace, 'statements', None)
+    if statements is not None:
+        _trace.started = time.perf_counter()
+        statements.append([statement, 0.0, executemany])
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(_trace, 'statements', None)
+    if statements:
+        statements[-1][1] = time.perf_counter() - _trace.started
+
+def find_n_plus_one(statements, threshold):
+    """[(sql, count, total seconds)] for SQL repeated at least threshold times, most repeated first"""
+    repeated = defaultdict(lambda: [0, 0.0])
+    for sql, duration, executemany in statements:
+        if not executemany:
+            repeated[sql][0] += 1
+            repeated[sql][1] += duration
+    return sorted(((sql, count, total) for sql, (count, total) in repeated.items() if count >= threshold),
+                  key=lambda item: -item[1])
+
+def format_report(method, path, elapsed, profiler, statements, n_plus_one, limit):
+    out = io.StringIO()
+    sql_time = sum(duration for _, duration, _ in statements)
+    out.write(f"{method} {path}: {elapsed * 1000:.1f} ms, {len(statements)} SQL statements in {sql_time * 1000:.1f} ms\n")
+
+    if n_plus_one:
+        out.write("\nPossible N+1 queries:\n")
+        for sql, count, total in n_plus_one:
+            out.write(f"  {count}x, {total * 1000:.2f} ms: {' '.join(sql.split())}\n")
+
+    out.write("\nSQL statements:\n")
+    for index, (sql, duration, executemany) in enumerate(statements, 1):
+        many = " (executemany)" if executemany else ""
+        out.write(f"  {index:>3}. {duration * 1000:8.2f} ms{many}  {' '.join(sql.split())}\n")
+
+    out.write("\nProfile:\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+def setup_profiling(app):
+    """Install the profiling hooks when PROFILING_ENABLED is set (call inside an app context)"""
+    if not app.config.get('PROFILING_ENABLED', False):
+        return False
+
+    key = app.config.get('PROFILING_KEY') or ''
+    if not key:
+        log.warning("PROFILING_ENABLED is set without PROFILING_KEY; request profiling stays off")
+        return False
+    threshold = app.config.get('PROFILING_N_PLUS_ONE', 5)
+    limit = app.config.get('PROFILING_STATS_LIMIT', 30)
+
+    engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def requested_mode():
+        value = request.headers.get('X-Profile')
+        if not value or not request.path.startswith('/api/'):
+            return None
+        # "<key>" or "<key>:body"
+        given, _, body = value.partition(':')
+        if not hmac.compare_digest(given, key):
+            return None
+        return 'body' if body == 'body' else 'log'
+
+    @app.before_request
+    def start_profile():
+        mode = requested_mode()
+        if not mode:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) already owns this thread
+            log.warning("Cannot profile %s: another profiler is active", request.path)
+            return
+        g.profile = (mode, profiler, time.perf_counter())
+        _trace.statements = []
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        mode, profiler, started = profile
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        statements = _trace.statements
+        _trace.statements = None
+
+        n_plus_one = find_n_plus_one(statements, threshold)
+        report = format_report(request.method, request.full_path.rstrip('?'), elapsed, profiler,
+                               statements, n_plus_one, limit)
+        log.info("Request profile\n%s", report)
+
+        # Only a successful response is replaced, keeping its status; errors such as a 401 pass through
+        if mode == 'body' and 200 <= response.status_code < 300:
+            response = Response(report, status=response.status_code, mimetype='text/plain')
+        response.headers['X-Profile-Time-Ms'] = f"{elapsed * 1000:.2f}"
+        response.headers['X-Profile-Queries'] = str(len(statements))
+        response.headers['X-Profile-Query-Time-Ms'] = f"{sum(duration for _, duration, _ in statements) * 1000:.2f}"
+        response.headers['X-Profile-N-Plus-One'] = str(len(n_plus_one))
+        return response
+
+    @app.teardown_request
+    def drop_profile(exc):
+        # A request that raised never reaches after_request
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile[1].disable()
+        _trace.statements = None
+
+    log.warning("Request profiling is enabled (X-Profile header)")
+    return True
@@ -0,0 +1,69 @@
+from flask import abort
+from sqlalchemy import func, cast, Integer
+from models import db, Room, Device
+
+# Columns every device listing needs; queries return plain tuples in this order
+DEVICE_FIELDS = ('id', 'name', 'type', 'status', 'value', 'room_id')
+DEVICE_COLUMNS = tuple(getattr(Device, field) for field in DEVICE_FIELDS)
+
+def _owned_devices(owner_id, *columns):
+    # One JOIN on room.owner_id instead of loading the owner's rooms first
+    # and filtering devices with an ever-growing IN list
+    return db.session.query(*columns).join(Room, Device.room_id == Room.id).filter(Room.owner_id == owner_id)
+
+def owner_device_rows(owner_id, types=None):
+    """(id, name, type, status, value, room_id) tuples for devices in rooms owned by owner_id"""
+    query = _owned_devices(owner_id, *DEVICE_COLUMNS)
+    if types:
+        query = query.filter(Device.type.in_(types))
+    return query.order_by(Device.id).all()
+
+def owner_type_counts(owner_id):
+    """(type, total, online) tuples for owner_id's devices, aggregated in SQL"""
+    device_type = func.coalesce(Device.type, 'unknown')
+    return _owned_devices(
+        owner_id,
+        device_type,
+        func.count(Device.id),
+        func.coalesce(func.sum(cast(Device.status, Integer)), 0)
+    ).group_by(device_type).all()
+
+def owner_room_rows(owner_id):
+    """(id, name) tuples for rooms owned by owner_id"""
+    return db.session.query(Room.id, Room.name).filter(Room.owner_id == owner_id).order_by(Room.id).all()
+
+def owner_ids():
+    """Ids of every user that owns at least one room"""
+    return [owner_id for owner_id, in db.session.query(Room.owner_id).filter(Room.owner_id.isnot(None)).distinct()]
+
+def owned_device_id(owner_id, device_id):
+    """device_id if it is in a room owned by owner_id, else None"""
+    return _owned_devices(owner_id, Device.id).filter(Device.id == device_id).scalar()
+
+def get_owned_device(owner_id, device_id):
+    """Device row (for updates) if it is in a room owned by owner_id, else None"""
+    return _owned_devices(owner_id, Device).filter(Device.id == device_id).first()
+
+def get_owned_device_or_404(owner_id, device_id):
+    device = get_owned_device(owner_id, device_id)
+    if device is None:
+        abort(404)
+    return device
+
+def get_owned_devices(owner_id, device_ids):
+    """{device_id: Device} for the given ids that are in rooms owned by owner_id"""
+    if not device_ids:
+        return {}
+    devices = _owned_devices(owner_id, Device).filter(Device.id.in_(set(device_ids))).all()
+    return {device.id: device for device in devices}
+
+def owned_room_id(owner_id, room_id):
+    """room_id if it is owned by owner_id, else None"""
+    return db.session.query(Room.id).filter(Room.id == room_id, Room.owner_id == owner_id).scalar()
+
+def get_room_devices_for_update(owner_id, room_id, types=None):
+    """Device rows in one of owner_id's rooms, ordered by id"""
+    query = _owned_devices(owner_id, Device).filter(Device.room_id == room_id)
+    if types:
+        query = query.filter(Device.type.in_(types))
+    return query.order_by(Device.id).all()
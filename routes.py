@@ -1,51 +1,120 @@
-from flask import Blueprint, jsonify, request
-from models import db, Room, Device
-from mqtt_client import publish_device_status, get_mqtt_status
+import base64
+import binascii
+import hashlib
+import math
+from urllib.parse import urlencode
+from flask import Blueprint, Response, current_app, jsonify, request
+from models import db, Device
+from storage import commit, writer
+from mqtt_client import publish_device_status, publish_devices_status, forget_device, get_mqtt_status
+from mqtt_publisher import PUBLISH_SYNCED, PUBLISH_UNCHANGED
 from auth_routes import token_required
-from datetime import datetime
+from history_recorder import record_device_state
+from history_rollups import BUCKETS, choose_bucket, delete_device_history, query_history
+from analytics import usage_report
+from device_cache import device_cache
+from serializers import device_dict, encode, encode_devices, json_response
+from event_hub import event_hub, EVICTED
+from repository import (DEVICE_FIELDS, get_owned_device_or_404, get_owned_devices, get_room_devices_for_update,
+                        owned_device_id, owned_room_id, owner_room_rows, owner_type_counts)
+from datetime import datetime, timedelta, timezone
 
 api = Blueprint('api', __name__)
 
+SENSOR_TYPES = ('sensor', 'temperature', 'humidity', 'motion', 'light_sensor')
+SENSOR_FIELDS = tuple(field for field in DEVICE_FIELDS if field != 'room_id')
+
 # Rooms
 @api.route('/rooms', methods=['GET'])
 @token_required
 def get_rooms(current_user):
     # Filter rooms by the current user's ID
-    rooms = Room.query.filter_by(owner_id=current_user.id).all()
-    return jsonify([{'id': room.id, 'name': room.name} for room in rooms])
+    return jsonify([{'id': room_id, 'name': name} for room_id, name in owner_room_rows(current_user.id)])
 
 # Devices
 @api.route('/devices', methods=['GET'])
 @token_required
 def get_devices(current_user):
-    # Get rooms owned by current user first
-    user_rooms = Room.query.filter_by(owner_id=current_user.id).all()
-    user_room_ids = [room.id for room in user_rooms]
-    
-    # Filter devices to only include those in rooms owned by current user
-    devices = Device.query.filter(Device.room_id.in_(user_room_ids)).all()
-    
-    return jsonify([{
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id
-    } for device in devices])
+    # Served from the in-process device cache (only devices in rooms owned by current user)
+    return device_listing(current_user.id)
 
 @api.route('/rooms/<int:room_id>/devices', methods=['GET'])
 @token_required
 def get_room_devices(current_user, room_id):
-    devices = Device.query.filter_by(room_id=room_id).all()
-    return jsonify([{
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id
-    } for device in devices])
+    return device_listing(current_user.id, room_id)
+
+def encode_cursor(device_id):
+    return base64.urlsafe_b64encode(str(device_id).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Device id a cursor points after; raises ValueError for malformed cursors"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+
+def device_listing(owner_id, room_id=None):
+    """Device list response with optional ?limit=&cursor= paging, ?fields= and ETag/304 support.
+
+    Without ``limit`` every device is returned, as before. With it, the next page's
+    cursor is sent in the X-Next-Cursor and Link headers while the body stays a list.
+    The ETag is the owner's cache version plus a hash of the request, so an unchanged
+    If-None-Match poll is answered with 304 without reading or serializing any devices.
+    """
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field for field in fields.split(',') if field]
+        unknown = [field for field in fields if field not in DEVICE_FIELDS]
+        if unknown:
+            return jsonify({'message': f'Unknown fields: {", ".join(unknown)}'}), 400
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+    
+    try:
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    
+    limit = request.args.get('limit')
+    if limit is not None:
+        max_limit = current_app.config.get('DEVICE_PAGE_MAX_LIMIT', 1000)
+        if not limit.isdigit() or not 1 <= int(limit) <= max_limit:
+            return jsonify({'message': f'limit must be between 1 and {max_limit}'}), 400
+        limit = int(limit)
+    
+    request_key = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    version = device_cache.owner_version(owner_id)
+    if version is not None:
+        etag = f"{device_cache.epoch}-{version}-{request_key}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+    
+    # Read again together with the devices: the owner may have changed since the check above
+    version, devices = device_cache.get_owner_devices_versioned(owner_id)
+    if room_id is not None:
+        devices = [device for device in devices if device['room_id'] == room_id]
+    
+    next_cursor = None
+    if after is not None:
+        devices = [device for device in devices if device['id'] > after]
+    if limit is not None and len(devices) > limit:
+        devices = devices[:limit]
+        next_cursor = encode_cursor(devices[-1]['id'])
+    if fields:
+        response = json_response(encode([{field: device[field] for field in fields} for device in devices]))
+    else:
+        # Each device's JSON is cached with its snapshot, so unchanged devices are not re-encoded
+        response = json_response(encode_devices(devices))
+    if version is not None:
+        response.set_etag(f"{device_cache.epoch}-{version}-{request_key}")
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return response
 
 @api.route('/devices', methods=['POST'])
 @token_required
@@ -59,25 +128,19 @@ def add_device(current_user):
         room_id=data['room_id']
     )
     db.session.add(device)
-    db.session.commit()
+    commit()
+    record_device_state(device)
     
     # Publish new device to MQTT
     publish_device_status(device)
     
-    return jsonify({
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id
-    }), 201
+    return jsonify(device_dict(device)), 201
     
 # this route for update the status of the devices afterr user control devices (MQTT Broker)
 @api.route('/devices/<int:device_id>', methods=['PUT'])
 @token_required
 def update_device(current_user, device_id):
-    device = Device.query.get_or_404(device_id)
+    device = get_owned_device_or_404(current_user.id, device_id)
     data = request.json
     
     if 'status' in data:
@@ -85,51 +148,91 @@ def update_device(current_user, device_id):
     if 'value' in data:
         device.value = data['value']
     
-    db.session.commit()
+    commit()
+    record_device_state(device)
     
-    # Publish device state change to MQTT and capture success/failure
-    mqtt_success = publish_device_status(device)
+    # Queue device state change for MQTT; this never waits on the broker
+    mqtt_result = publish_device_status(device)
     
-    response = {
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id,
-        'mqtt_published': mqtt_success
-    }
+    response = device_dict(device)
+    response['mqtt_published'] = mqtt_result in PUBLISH_SYNCED
+    response['mqtt_delivery'] = mqtt_result
     
     return jsonify(response)
 
 @api.route('/devices/<int:device_id>/toggle', methods=['POST'])
 @token_required
 def toggle_device(current_user, device_id):
-    device = Device.query.get_or_404(device_id)
+    device = get_owned_device_or_404(current_user.id, device_id)
     device.status = not device.status
-    db.session.commit()
-    
-    # Publish device state change to MQTT and track success
-    mqtt_success = publish_device_status(device)
-    
-    response = {
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id,
-        'mqtt_published': mqtt_success
-    }
+    commit()
+    record_device_state(device)
+    
+    # Queue device state change for MQTT; this never waits on the broker
+    mqtt_result = publish_device_status(device)
+    
+    response = device_dict(device)
+    response['mqtt_published'] = mqtt_result in PUBLISH_SYNCED
+    response['mqtt_delivery'] = mqtt_result
     
     return jsonify(response)
 
 @api.route('/devices/<int:device_id>/control', methods=['POST'])
 @token_required
 def control_device(current_user, device_id):
-    device = Device.query.get_or_404(device_id)
-    data = request.json
+    device = get_owned_device_or_404(current_user.id, device_id)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Request body must be a JSON object'}), 400
+    error = control_error(data)
+    if error:
+        return jsonify({'message': error}), 400
+    
+    changed = apply_control(device, data)
+    
+    # commit changes to the database only if something changed
+    commit()
+    if changed:
+        record_device_state(device)
+    
+    # Ensure device state is published to MQTT even if the database didn't change,
+    # so the broker stays in sync; a state it already has since the last (re)connect is not re-sent
+    mqtt_result = publish_device_status(device)
     
+    response = device_dict(device)
+    response['message'] = 'Device control successful'
+    response['mqtt_published'] = mqtt_result in PUBLISH_SYNCED
+    response['mqtt_delivery'] = mqtt_result
+    
+    return jsonify(response)
+
+# Numeric parameters of the type-specific "command" object
+COMMAND_VALUES = ('brightness', 'temperature', 'speed')
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def control_error(data):
+    """Why a control command can't be applied, or None if its fields have valid types"""
+    # 1/0 are accepted as well, as they always were
+    if 'status' in data and not (isinstance(data['status'], int) and data['status'] in (0, 1)):
+        return '"status" must be true, false, 1 or 0'
+    if 'value' in data and not _is_number(data['value']):
+        return '"value" must be a number'
+    if 'command' in data:
+        if not isinstance(data['command'], dict):
+            return '"command" must be an object'
+        for name in COMMAND_VALUES:
+            if name in data['command'] and not _is_number(data['command'][name]):
+                return f'"command.{name}" must be a number'
+    return None
+
+def apply_control(device, data):
+    """Apply one control command (status, value and/or type-specific command) to a device.
+
+    The command must have passed control_error(). Returns True if the device
+    changed. The caller commits and publishes.
+    """
     # Track if anything changed
     changed = False
     
@@ -140,8 +243,9 @@ def control_device(current_user, device_id):
     
     # Handle device control based on type and parameters
     if 'status' in data:
-        if device.status != data['status']:
-            device.status = data['status']
+        status = bool(data['status'])
+        if device.status != status:
+            device.status = status
             changed = True
         
     if 'value' in data:
@@ -164,51 +268,247 @@ def control_device(current_user, device_id):
                 device.value = data['command']['speed']
                 changed = True
     
-    # commit changes to the database only if something changed
-    db.session.commit()
-    
-    # Ensure device state change is published to MQTT
-    # Important: Always publish regardless of whether the database changed
-    # The device state must be synchronized with ShiftR
-    success = publish_device_status(device)
-    
-    response = {
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id,
-        'message': 'Device control successful',
-        'mqtt_published': success
+    return changed
+
+def commit_controls(targets, changed):
+    """Commit controlled devices in one transaction and publish them as one MQTT burst.
+
+    targets are (device, command) pairs already applied with apply_control() and
+    changed maps device id to whether it changed. Returns the burst's MQTT result,
+    PUBLISH_UNCHANGED when there are no targets.
+    """
+    if not targets:
+        return PUBLISH_UNCHANGED
+    commit()
+    devices = list({device.id: device for device, command in targets}.values())
+    for device in devices:
+        if changed[device.id]:
+            record_device_state(device)
+    
+    # Like single-device control, every addressed device is re-published
+    return publish_devices_status(devices)
+
+def device_result(device, changed):
+    return {
+        'device_id': device.id,
+        'result': 'updated' if changed else 'unchanged',
+        'device': device_dict(device)
     }
+
+@api.route('/devices/batch', methods=['POST'])
+@token_required
+def control_devices_batch(current_user):
+    data = request.get_json(silent=True)
+    commands = data.get('commands') if isinstance(data, dict) else data
+    if not isinstance(commands, list) or not commands:
+        return jsonify({'message': 'Request body must contain a non-empty "commands" list'}), 400
+    
+    max_commands = current_app.config.get('BATCH_MAX_COMMANDS', 500)
+    if len(commands) > max_commands:
+        return jsonify({'message': f'At most {max_commands} commands per batch'}), 400
+    
+    # One query for every device addressed by the batch
+    device_ids = [command.get('device_id') for command in commands
+                  if isinstance(command, dict) and isinstance(command.get('device_id'), int)]
+    devices = get_owned_devices(current_user.id, device_ids)
+    
+    results = []
+    targets = []
+    for command in commands:
+        device_id = command.get('device_id') if isinstance(command, dict) else None
+        if not isinstance(device_id, int):
+            results.append({'device_id': device_id, 'result': 'invalid',
+                            'error': 'Each command must be an object with an integer "device_id"'})
+        elif device_id not in devices:
+            results.append({'device_id': device_id, 'result': 'not_found', 'error': 'Resource not found'})
+        else:
+            # Checked before anything is applied: one bad command must not fail the shared commit
+            error = control_error(command)
+            if error:
+                results.append({'device_id': device_id, 'result': 'invalid', 'error': error})
+            else:
+                targets.append((devices[device_id], command))
+                results.append(None)
+    
+    changed = {}
+    for device, command in targets:
+        changed[device.id] = apply_control(device, command) or changed.get(device.id, False)
+    mqtt_result = commit_controls(targets, changed)
+    
+    target_results = iter(targets)
+    for index, result in enumerate(results):
+        if result is None:
+            device, command = next(target_results)
+            results[index] = device_result(device, changed[device.id])
     
-    return jsonify(response)
+    return jsonify({
+        'message': f'Applied {len(targets)} of {len(commands)} commands',
+        'results': results,
+        # Nothing was sent when no command could be applied
+        'mqtt_published': bool(targets) and mqtt_result in PUBLISH_SYNCED,
+        'mqtt_delivery': mqtt_result
+    })
+
+@api.route('/rooms/<int:room_id>/control', methods=['POST'])
+@token_required
+def control_room(current_user, room_id):
+    if owned_room_id(current_user.id, room_id) is None:
+        return jsonify(error="Resource not found"), 404
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Request body must be a JSON object'}), 400
+    
+    # Optional filter, e.g. {"types": ["light"], "status": false} turns off only the lights
+    types = data.get('types')
+    if types is not None and not isinstance(types, list):
+        return jsonify({'message': '"types" must be a list of device types'}), 400
+    error = control_error(data)
+    if error:
+        return jsonify({'message': error}), 400
+    devices = get_room_devices_for_update(current_user.id, room_id, types)
+    
+    targets = [(device, data) for device in devices]
+    changed = {device.id: apply_control(device, data) for device in devices}
+    mqtt_result = commit_controls(targets, changed)
+    
+    return jsonify({
+        'message': f'Applied command to {len(devices)} devices',
+        'room_id': room_id,
+        'results': [device_result(device, changed[device.id]) for device in devices],
+        # Nothing was sent when no command could be applied
+        'mqtt_published': bool(targets) and mqtt_result in PUBLISH_SYNCED,
+        'mqtt_delivery': mqtt_result
+    })
 
 @api.route('/devices/<int:device_id>', methods=['DELETE'])
 @token_required
 def delete_device(current_user, device_id):
-    device = Device.query.get_or_404(device_id)
+    device = get_owned_device_or_404(current_user.id, device_id)
     
     # Get device info before deletion for response
-    device_info = {
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id
-    }
+    device_info = device_dict(device)
     
-    # Delete the device from database
-    db.session.delete(device)
-    db.session.commit()
+    # Delete the device together with its history, which can't outlive it (device_id is NOT NULL)
+    with writer:
+        delete_device_history(device.id)
+        db.session.delete(device)
+        db.session.commit()
+    forget_device(device_info['id'])
     
     return jsonify({
         'message': 'Device deleted successfully',
         'device': device_info
     })
 
+def parse_time_param(value):
+    """Parse an ISO 8601 or epoch-seconds query parameter into naive UTC; raises ValueError if invalid"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        try:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError, OSError):
+            # nan, or outside the range datetime and the platform's time functions support
+            raise ValueError(f"Timestamp out of range: {value}") from None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Downsampled device history for charts
+@api.route('/devices/<int:device_id>/history', methods=['GET'])
+@token_required
+def get_device_history(current_user, device_id):
+    if owned_device_id(current_user.id, device_id) is None:
+        return jsonify(error="Resource not found"), 404
+    
+    try:
+        end = parse_time_param(request.args['to']) if 'to' in request.args else datetime.utcnow()
+        start = parse_time_param(request.args['from']) if 'from' in request.args else end - timedelta(hours=24)
+    except (ValueError, OverflowError):
+        return jsonify({'message': 'Invalid from/to, expected ISO 8601 or epoch seconds'}), 400
+    
+    if start >= end:
+        return jsonify({'message': "'from' must be earlier than 'to'"}), 400
+    
+    bucket = request.args.get('bucket') or choose_bucket(start, end)
+    if bucket not in BUCKETS:
+        return jsonify({'message': f"Invalid bucket, expected one of: {', '.join(BUCKETS)}"}), 400
+    
+    return jsonify({
+        'device_id': device_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'bucket': bucket,
+        'points': query_history(device_id, start, end, bucket)
+    })
+
+def analytics_params():
+    """(start, end, utc_offset) from ?from=&to=&utc_offset=, or an error response"""
+    try:
+        end = parse_time_param(request.args['to']) if 'to' in request.args else datetime.utcnow()
+        start = parse_time_param(request.args['from']) if 'from' in request.args else end - timedelta(days=7)
+    except (ValueError, OverflowError):
+        return None, (jsonify({'message': 'Invalid from/to, expected ISO 8601 or epoch seconds'}), 400)
+    
+    if start >= end:
+        return None, (jsonify({'message': "'from' must be earlier than 'to'"}), 400)
+    max_days = current_app.config.get('ANALYTICS_MAX_RANGE_DAYS', 92)
+    if end - start > timedelta(days=max_days):
+        return None, (jsonify({'message': f'Range must not exceed {max_days} days'}), 400)
+    
+    # Minutes east of UTC for the heatmap, e.g. 420 for UTC+7
+    utc_offset = request.args.get('utc_offset', '0')
+    if not utc_offset.lstrip('-').isdigit() or not -720 <= int(utc_offset) <= 840:
+        return None, (jsonify({'message': 'utc_offset must be minutes between -720 and 840'}), 400)
+    return (start, end, int(utc_offset)), None
+
+def analytics_response(scope, device_ids):
+    params, error = analytics_params()
+    if error:
+        return error
+    start, end, utc_offset = params
+    
+    report = usage_report(device_ids, start, end, utc_offset)
+    return jsonify(dict(scope, **{
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'utc_offset': utc_offset
+    }, **report))
+
+def type_filter(devices):
+    # Optional ?type=light,fan; averaging values across device types is rarely meaningful
+    types = request.args.get('type')
+    if not types:
+        return devices
+    types = set(types.split(','))
+    return [device for device in devices if device['type'] in types]
+
+# Usage analytics: duty cycle, on/off transitions and an hour x weekday value heatmap
+@api.route('/devices/<int:device_id>/analytics', methods=['GET'])
+@token_required
+def get_device_analytics(current_user, device_id):
+    if owned_device_id(current_user.id, device_id) is None:
+        return jsonify(error="Resource not found"), 404
+    return analytics_response({'device_id': device_id}, [device_id])
+
+@api.route('/rooms/<int:room_id>/analytics', methods=['GET'])
+@token_required
+def get_room_analytics(current_user, room_id):
+    if owned_room_id(current_user.id, room_id) is None:
+        return jsonify(error="Resource not found"), 404
+    devices = type_filter(device_cache.get_room_devices(current_user.id, room_id))
+    return analytics_response({'room_id': room_id}, [device['id'] for device in devices])
+
+@api.route('/analytics', methods=['GET'])
+@token_required
+def get_user_analytics(current_user):
+    devices = type_filter(device_cache.get_owner_devices(current_user.id))
+    return analytics_response({'user_id': current_user.id}, [device['id'] for device in devices])
+
 # Add a new route to check MQTT status
 @api.route('/mqtt_status', methods=['GET'])
 def mqtt_connection_status():
@@ -219,59 +519,36 @@ def mqtt_connection_status():
 @api.route('/sensor_data', methods=['GET'])
 @token_required
 def get_sensor_data(current_user):
-    # Get rooms owned by current user first
-    user_rooms = Room.query.filter_by(owner_id=current_user.id).all()
-    user_room_ids = [room.id for room in user_rooms]
-    
-    # Filter sensor devices to only include those in rooms owned by current user
-    sensors = Device.query.filter(
-        Device.room_id.in_(user_room_ids),
-        Device.type.in_(['sensor', 'temperature', 'humidity', 'motion', 'light_sensor'])
-    ).all()
-    
-    return jsonify([{
-        'id': device.id,
-        'name': device.name,
-        'type': device.type,
-        'status': device.status,
-        'value': device.value,
-        'room_id': device.room_id,
-        'timestamp': datetime.now().isoformat()
-    } for device in sensors])
+    # Sensor devices in rooms owned by current user, served from the device cache
+    sensors = [device for device in device_cache.get_owner_devices(current_user.id)
+               if device['type'] in SENSOR_TYPES]
+    
+    now = datetime.now().isoformat()
+    return jsonify([dict(device, timestamp=now) for device in sensors])
 
 # Advanced sensor data with room grouping
 @api.route('/advanced_sensor_data', methods=['GET'])
 @token_required
 def get_advanced_sensor_data(current_user):
-    # Get rooms owned by current user
-    user_rooms = Room.query.filter_by(owner_id=current_user.id).all()
-    user_room_ids = [room.id for room in user_rooms]
-    
-    # Get all sensors in these rooms
-    sensors = Device.query.filter(
-        Device.room_id.in_(user_room_ids),
-        Device.type.in_(['sensor', 'temperature', 'humidity', 'motion', 'light_sensor'])
-    ).all()
+    now = datetime.now().isoformat()
     
     # Group by rooms
     rooms_data = {}
-    for room in user_rooms:
-        room_sensors = [s for s in sensors if s.room_id == room.id]
-        rooms_data[room.id] = {
-            'room_name': room.name,
-            'room_id': room.id,
-            'sensors': [{
-                'id': device.id,
-                'name': device.name,
-                'type': device.type,
-                'status': device.status,
-                'value': device.value,
-                'timestamp': datetime.now().isoformat()
-            } for device in room_sensors]
+    for room in device_cache.get_owner_rooms(current_user.id):
+        rooms_data[room['id']] = {
+            'room_name': room['name'],
+            'room_id': room['id'],
+            'sensors': []
         }
     
+    for device in device_cache.get_owner_devices(current_user.id):
+        if device['type'] in SENSOR_TYPES and device['room_id'] in rooms_data:
+            sensor = {field: device[field] for field in SENSOR_FIELDS}
+            sensor['timestamp'] = now
+            rooms_data[device['room_id']]['sensors'].append(sensor)
+    
     return jsonify({
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': now,
         'rooms': rooms_data
     })
 
@@ -279,28 +556,16 @@ def get_advanced_sensor_data(current_user):
 @api.route('/device_status', methods=['GET'])
 @token_required
 def get_device_status(current_user):
-    # Get rooms owned by current user
-    user_rooms = Room.query.filter_by(owner_id=current_user.id).all()
-    user_room_ids = [room.id for room in user_rooms]
-    
-    # Get all devices in these rooms
-    devices = Device.query.filter(Device.room_id.in_(user_room_ids)).all()
-    
-    # Count devices by type and status
-    device_count = len(devices)
-    online_count = sum(1 for device in devices if device.status)
+    # Per-type counts: kept incrementally by the device cache, or one GROUP BY query
+    type_counts = device_cache.get_owner_type_counts(current_user.id)
+    if type_counts is None:
+        type_counts = {device_type: {"total": total, "online": int(online)}
+                       for device_type, total, online in owner_type_counts(current_user.id)}
+    
+    device_count = sum(counts["total"] for counts in type_counts.values())
+    online_count = sum(counts["online"] for counts in type_counts.values())
     offline_count = device_count - online_count
     
-    # Count by type
-    type_counts = {}
-    for device in devices:
-        device_type = device.type or "unknown"
-        if device_type not in type_counts:
-            type_counts[device_type] = {"total": 0, "online": 0}
-        type_counts[device_type]["total"] += 1
-        if device.status:
-            type_counts[device_type]["online"] += 1
-    
     # Check MQTT broker status
     mqtt_status = get_mqtt_status()
     
@@ -313,6 +578,39 @@ def get_device_status(current_user):
         'timestamp': datetime.now().isoformat()
     })
 
+# Push stream of device updates (Server-Sent Events)
+@api.route('/stream', methods=['GET'])
+@token_required(allow_query_token=True)
+def stream_device_updates(current_user):
+    subscription = event_hub.subscribe(current_user.id)
+    if subscription is None:
+        return jsonify({'message': 'Too many streaming clients, try again later'}), 503
+    
+    keepalive = current_app.config.get('STREAM_KEEPALIVE', 15)
+    
+    def generate():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=keepalive)
+                if event is EVICTED or subscription.evicted:
+                    # Fell too far behind; the client reconnects and resyncs
+                    yield b"event: evicted\ndata: {}\n\n"
+                    return
+                if event is None:
+                    yield b": keepalive\n\n"
+                    continue
+                event_id, data = event
+                # Payloads are already encoded JSON bytes, shared with the MQTT publish
+                yield b"id: %d\nevent: device\ndata: %s\n\n" % (event_id, data)
+        finally:
+            event_hub.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # Public MQTT status endpoint for system monitoring
 @api.route('/system/mqtt_status', methods=['GET'])
 def system_mqtt_status():
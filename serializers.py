@@ -0,0 +1,154 @@
+import json
+import logging
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from repository import DEVICE_FIELDS
+
+log = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used without it
+    orjson = None
+
+# json.dumps() builds a new encoder per call when given separators; most calls can share one
+_compact_encoder = json.JSONEncoder(separators=(',', ':'))
+
+def _json_dumps(obj, default=None, sort_keys=False):
+    if default is None and not sort_keys:
+        return _compact_encoder.encode(obj).encode()
+    return json.dumps(obj, separators=(',', ':'), default=default, sort_keys=sort_keys).encode()
+
+def _orjson_dumps(obj, default=None, sort_keys=False):
+    # Datetimes go through default() so they encode exactly like the stdlib encoder
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=default, option=option)
+
+# name -> (dumps, loads); dumps(obj, default=None, sort_keys=False) returns bytes
+ENCODERS = {'json': (_json_dumps, json.loads)}
+if orjson is not None:
+    ENCODERS['orjson'] = (_orjson_dumps, orjson.loads)
+
+encoder_name = 'orjson' if orjson is not None else 'json'
+_dumps, _loads = ENCODERS[encoder_name]
+
+# device_id -> (snapshot, encoded bytes); reused for as long as the snapshot is current
+_encoded_devices = {}
+_encoded_devices_max = 100000
+
+# Devices a mostly-uncached list encode adds to the fragment cache, so the cache warms
+# over a few requests without making any one of them much slower than a plain encode
+WARM_FRAGMENTS_PER_CALL = 500
+
+def set_encoder(name):
+    """Select the JSON encoder: 'orjson', 'json', or 'auto' for the fastest one installed"""
+    global encoder_name, _dumps, _loads
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+    if name not in ENCODERS:
+        raise ValueError(f"JSON encoder '{name}' is not available (installed: {', '.join(ENCODERS)})")
+    encoder_name = name
+    _dumps, _loads = ENCODERS[name]
+    _encoded_devices.clear()
+    return name
+
+def encode(obj, default=None, sort_keys=False):
+    """Encode obj to compact JSON bytes with the selected encoder"""
+    return _dumps(obj, default=default, sort_keys=sort_keys)
+
+def decode(data):
+    """Decode JSON from bytes or str with the selected encoder"""
+    return _loads(data)
+
+def device_dict(device):
+    """Project a Device row into the compact dict used by every device response and payload"""
+    return {field: getattr(device, field) for field in DEVICE_FIELDS}
+
+def encode_device(snapshot):
+    """JSON bytes for a device snapshot, encoded once per snapshot.
+
+    Snapshots from the device cache are replaced, never mutated, when a device
+    changes, so the identity check is enough to tell a stale encoding.
+    """
+    entry = _encoded_devices.get(snapshot['id'])
+    if entry is not None and entry[0] is snapshot:
+        return entry[1]
+    encoded = _dumps(snapshot)
+    if len(_encoded_devices) >= _encoded_devices_max:
+        _encoded_devices.clear()
+    _encoded_devices[snapshot['id']] = (snapshot, encoded)
+    return encoded
+
+def encode_devices(snapshots):
+    """JSON array bytes for a list of device snapshots.
+
+    With the stdlib encoder, cached per-device fragments are joined when most
+    of the devices have one. Otherwise one call encoding the whole list is
+    cheaper than encoding the devices one by one.
+    """
+    if encoder_name == 'orjson':
+        # orjson encodes a whole list faster than cached fragments can be joined
+        return _dumps(snapshots)
+
+    fragments = []
+    missing = []
+    for index, snapshot in enumerate(snapshots):
+        entry = _encoded_devices.get(snapshot['id'])
+        if entry is not None and entry[0] is snapshot:
+            fragments.append(entry[1])
+        else:
+            fragments.append(None)
+            missing.append(index)
+
+    if len(missing) * 2 > len(snapshots):
+        for index in missing[:WARM_FRAGMENTS_PER_CALL]:
+            encode_device(snapshots[index])
+        return _dumps(snapshots)
+
+    for index in missing:
+        fragments[index] = encode_device(snapshots[index])
+    return b'[' + b','.join(fragments) + b']'
+
+def device_payload(device, timestamp, **meta):
+    """Status payload published over MQTT and pushed to streaming clients, plus any meta fields"""
+    data = device_dict(device)
+    data['timestamp'] = timestamp
+    data.update(meta)
+    return _dumps(data)
+
+def json_response(body, status=200):
+    """Response for an already encoded JSON body"""
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through the selected encoder.
+
+    Keeps Flask's behaviour for everything else: datetimes, dataclasses and
+    the other types DefaultJSONProvider.default() handles, sorted keys, and
+    pretty printing in debug mode.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return _dumps(obj, default=self.default, sort_keys=self.sort_keys).decode()
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            _dumps(obj, default=self.default, sort_keys=self.sort_keys),
+            mimetype=self.mimetype
+        )
+
+def setup_serializers(app):
+    """Pick the encoder from JSON_ENCODER and route jsonify() through it"""
+    global _encoded_devices_max
+    name = set_encoder(app.config.get('JSON_ENCODER', 'auto'))
+    _encoded_devices_max = app.config.get('DEVICE_CACHE_MAX_DEVICES', 100000)
+    app.json = FastJSONProvider(app)
+    log.info("JSON encoder: %s", name)
+    return name
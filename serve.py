@@ -0,0 +1,75 @@
+"""Production entry point: serves the app with gunicorn using several worker processes.
+
+    python serve.py
+
+Workers and threads come from WEB_WORKERS / WEB_THREADS (see config.py). Each
+worker builds its own app after the fork, so every worker has its own database
+engine, caches and MQTT connection. Only one of them, chosen through a file lock,
+subscribes to device commands (see mqtt_client.py). The database is prepared
+once in the master before any worker starts.
+"""
+from flask import Flask
+from config import Config
+from models import db
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn doesn't run on Windows
+    BaseApplication = None
+
+def prepare_database():
+    """Create tables, indexes and seed data once, so workers don't race to do it"""
+    from app import init_database
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    with app.app_context():
+        init_database(app)
+        # Workers are forked from this process and must not share its connections
+        db.engine.dispose()
+
+def check_multi_worker_config():
+    """Refuse settings under which workers' device caches can't follow each other's changes"""
+    from mqtt_client import MQTT_PUBLISH_TOPICS
+    if Config.WEB_WORKERS > 1 and Config.DEVICE_CACHE_ENABLED and 'all' not in MQTT_PUBLISH_TOPICS:
+        raise SystemExit("Running several workers with the device cache needs 'all' in MQTT_PUBLISH_TOPICS "
+                         "(workers sync their caches over all/updates); add it, set WEB_WORKERS=1 "
+                         "or DEVICE_CACHE_ENABLED=false")
+
+if BaseApplication:
+    class SmartHomeServer(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Runs in each worker after the fork: threads and connections are per process
+            from app import create_app
+            return create_app()
+
+def main():
+    if BaseApplication is None:
+        from app import create_app
+        print("gunicorn is not installed; serving with one process on the threaded development server")
+        host, port = Config.WEB_BIND.rsplit(':', 1)
+        create_app().run(host=host, port=int(port), threaded=True)
+        return
+
+    check_multi_worker_config()
+    prepare_database()
+    print(f"Starting {Config.WEB_WORKERS} workers x {Config.WEB_THREADS} threads on {Config.WEB_BIND}")
+    SmartHomeServer({
+        'bind': Config.WEB_BIND,
+        'workers': Config.WEB_WORKERS,
+        'threads': Config.WEB_THREADS,
+        'worker_class': 'gthread',
+        'timeout': Config.WEB_TIMEOUT,
+        'preload_app': False
+    }).run()
+
+if __name__ == '__main__':
+    main()
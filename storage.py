@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from sqlalchemy import event, text
+from models import db
+
+log = logging.getLogger(__name__)
+
+# PRAGMAs reported at startup, in the order they are applied
+PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size')
+
+class WriterQueue:
+    """FIFO gate that lets one thread at a time write to the database.
+
+    SQLite allows a single writer; letting request threads, the MQTT ingest
+    worker and the history recorder race for its lock ends in "database is
+    locked" errors. Writers instead take a ticket and run in arrival order.
+    With WAL enabled readers never wait for this queue. Re-entrant for the
+    thread that holds it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._holder = None
+        self._depth = 0
+        self.writes = 0
+        self.max_wait = 0.0
+
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._holder == me:
+                self._depth += 1
+                return self
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            started = time.monotonic()
+            while ticket != self._serving:
+                self._cond.wait()
+            self.max_wait = max(self.max_wait, time.monotonic() - started)
+            self._holder = me
+            self._depth = 1
+            self.writes += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self._holder = None
+                self._serving += 1
+                self._cond.notify_all()
+        return False
+
+    def waiting(self):
+        """Writers queued behind the current holder"""
+        with self._cond:
+            return self._next_ticket - self._serving - (1 if self._holder else 0)
+
+writer = WriterQueue()
+
+def commit():
+    """Commit db.session through the single writer queue"""
+    with writer:
+        db.session.commit()
+
+def _pragma_statements(config):
+    return (
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}"
+    )
+
+def init_storage(app):
+    """Apply the SQLite storage profile to every new connection (call inside an app context)"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return {}
+
+    statements = _pragma_statements(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    # Connections opened before the listener existed don't have the profile
+    engine.dispose()
+    return report_pragmas()
+
+def report_pragmas():
+    """Log and return the PRAGMA values a fresh connection actually ended up with"""
+    with db.engine.connect() as connection:
+        effective = {name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in PRAGMAS}
+    log.info("SQLite storage profile: %s", ", ".join(f"{name}={value}" for name, value in effective.items()))
+    return effective